@@ -0,0 +1,473 @@
+import argparse
+import contextlib
+import curses
+import io
+import json
+import os
+import platform
+import random
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import race_engine
+from replay import ReplayPlayer, ReplayRecorder
+from virtual_screen import VirtualScreen, virtual_terminal
+
+try:
+    import numpy as np
+    import race_numpy
+except ImportError:  # NumPy is optional, only the Python engine is measured without it
+    race_numpy = None
+
+# Benchmark of every variant of the game, run headless: each script runs unmodified
+# in its own process, with curses replaced by a model of the terminal and time by a
+# virtual clock, so that a race takes no longer than its computations.
+#
+#   ticks_per_sec        frames of the game loop per second, curses calls excluded
+#   render_ms_per_frame  time spent in the curses calls of a frame
+#   bytes_per_frame      bytes a real terminal would receive for a frame
+#   peak_memory_kb       growth of the peak resident memory of the process during the run
+#
+# With --headless, the race engines are measured alone instead, as the odds and the
+# tournament run them: frames per second of a race of every field size, and of a
+# batch of races for the NumPy backend. With --time_steps, the NumPy backend runs whole
+# races in steps of several frames, and their finishing distributions are compared with
+# the races run frame by frame:
+#
+#   placing_distance     total variation distance between the places of every lane, and
+#                        the same at one frame per step
+#   placing_noise        the same between two seeds at one frame per step, the noise of the measure
+#   placing_ok           whether placing_distance is within PLACING_TOLERANCE of the noise: the
+#                        placings do not depend on the step; the run fails if one is not
+#   lane_bias            largest gap between the wins of a lane and the average
+#
+# With --replays, races of the engine are recorded as the game records them and played
+# back, and the replays are compared with the races tick by tick:
+#
+#   timed_out            races that ended on their timeout
+#   mismatches           races whose replay differs from the race at some tick; the run fails if any
+#
+# With --unified, every variant runs with its own game loop, then its rules run on
+# race_engine alone, and the ticks per second of both are compared.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Script of every variant, and whether it takes the size of the field
+SCRIPTS = {
+    "stable": (os.path.join(HERE, "..", "stable", "tortoise_rushv4.py"), True),
+    "v1": (os.path.join(HERE, "tortoise_rush.py"), False),  # Always 5 tortoises
+    "v2": (os.path.join(HERE, "tortoise_rushv2.py"), True),
+    "v3": (os.path.join(HERE, "tortoise_rushv3.py"), True),
+    "v4.1": (os.path.join(HERE, "tortoise_rushv4.1.py"), True),
+    "v4.2": (os.path.join(HERE, "tortoise_rushv4.2.py"), True),
+    "v5": (os.path.join(HERE, "tortoise_rushv5.py"), True),
+    "v6": (os.path.join(HERE, "tortoise_rushv6.py"), True),
+    "v7": (os.path.join(HERE, "tortoise_rushv7.py"), True),
+    "v8": (os.path.join(HERE, "tortoise_rushv8.py"), True),
+}
+EXTRA_ARGS = {"v8": ["--odds_budget", "0", "--seed", "1"]}  # No odds: they run in other processes
+
+FIELDS = [5, 50, 500, 5000]
+TERMINALS = ["24x80", "50x160", "fit"]  # fit: tall enough for two rows per lane
+FRAMES = 50  # Frames measured in every run, races are cut short after them
+ENGINE_FRAMES = 200  # Frames measured in every headless run
+NUMPY_CELLS = 2**16  # Tortoises of the batch of races of a NumPy run, as in the odds
+PLACING_CELLS = 100_000  # Tortoises of the races compared at every time step
+PLACING_FINISH_LINE = 70
+PLACING_TOLERANCE = 0.02  # Placing distance allowed above the noise, for any time step
+REPLAY_RACES = 200  # Races recorded and played back with --replays
+REPLAY_FINISH_LINE = 110  # Far enough for most races with a timeout to end on it
+
+_perf_counter = time.perf_counter  # The real clock, time.perf_counter is replaced during a run
+
+
+class FrameLimit(Exception):
+    """Raised by the screen once the frames of the run have been drawn."""
+
+
+class BenchmarkScreen(VirtualScreen):
+    """A virtual screen that times the curses calls and stops the game after a number of frames."""
+
+    def __init__(self, height, width, frames):
+        super().__init__(height, width)
+        self.frames = frames
+        self.render_time = 0.0
+        self.first_frame = None  # Clock and render time at the first frame, setup is not measured
+        self.last_frame = None
+
+    def clear(self):
+        start = _perf_counter()
+        super().clear()
+        self.render_time += _perf_counter() - start
+
+    def addstr(self, *args):
+        start = _perf_counter()
+        try:
+            super().addstr(*args)
+        finally:
+            self.render_time += _perf_counter() - start
+
+    def refresh(self):
+        start = _perf_counter()
+        super().refresh()
+        self.render_time += _perf_counter() - start
+        self.last_frame = (_perf_counter(), self.render_time)
+        if self.first_frame is None:
+            self.first_frame = self.last_frame
+        if self.refreshes >= self.frames:
+            raise FrameLimit
+
+
+def terminal_size(terminal, num_tortoises):
+    if terminal == "fit":
+        return max(24, 2 * num_tortoises + 6), 120
+    height, width = terminal.split("x")
+    return int(height), int(width)
+
+
+def run_case(variant, num_tortoises, height, width, frames=FRAMES, seed=0, snapshot=False):
+    """Run one variant on one field and terminal size, in this process, and measure it.
+
+    With snapshot, the result also holds the text of the last frame, to compare the
+    variants or two versions of one.
+    """
+    path, sized = SCRIPTS[variant]
+    screen = BenchmarkScreen(height, width, frames)
+    result = {"variant": variant, "tortoises": num_tortoises if sized else 5, "terminal": [height, width]}
+
+    # A virtual clock: sleeping only moves it forward
+    clock = [time.time()]
+
+    def sleep(seconds):
+        clock[0] += max(0, seconds)
+
+    time.sleep = sleep
+    time.time = time.perf_counter = lambda: clock[0]
+
+    argv = [path] + (["--num_tortoises", str(num_tortoises)] if sized else []) + EXTRA_ARGS.get(variant, [])
+    random.seed(seed)
+    sys.argv = argv
+    sys.path.insert(0, os.path.dirname(path))
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with virtual_terminal(screen), contextlib.redirect_stdout(io.StringIO()):
+            wrapper = curses.wrapper
+
+            def checked_wrapper(func, *args):
+                try:
+                    return wrapper(func, *args)
+                except ValueError as e:
+                    result["error"] = str(e)  # The script would print it and quit
+
+            curses.wrapper = checked_wrapper
+            runpy.run_path(path, run_name="__main__")
+    except FrameLimit:
+        pass
+    except curses.error as e:
+        result["error"] = f"curses.error: {e}"  # The script drew outside of the terminal
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+    if sys.platform == "darwin":
+        peak //= 1024  # Bytes there, kilobytes everywhere else
+
+    # Game loop time between the first and the last frame, without the drawing
+    frames_drawn = max(screen.refreshes, 1)
+    loop_time = 0.0
+    if screen.first_frame:
+        loop_time = (screen.last_frame[0] - screen.first_frame[0]) - (screen.last_frame[1] - screen.first_frame[1])
+    result.update(
+        frames=screen.refreshes,
+        ticks_per_sec=(frames_drawn - 1) / loop_time if loop_time > 0 else None,
+        render_ms_per_frame=screen.render_time * 1000 / frames_drawn,
+        bytes_per_frame=screen.total_bytes / frames_drawn,
+        peak_memory_kb=peak,
+    )
+    result.setdefault("error", None)
+    if snapshot:
+        result["frame"] = [row.rstrip() for row in screen.text()]
+    return result
+
+
+def run_engine(backend, variant, num_tortoises, frames=ENGINE_FRAMES, seed=0):
+    """Run one race of the engine, or a batch of races of the NumPy backend, without any screen.
+
+    The finish line is out of reach so that the field only gets smaller with the bombs,
+    the run stops early if they blow everybody up.
+    """
+    rules = race_engine.VARIANTS[variant]
+    if backend == "numpy":
+        num_races = max(1, NUMPY_CELLS // num_tortoises)
+        races = race_numpy.new_races(num_races, num_tortoises, float("inf"), rules, seed)
+        start = _perf_counter()
+        race_numpy.run(races, max_ticks=frames)
+        ticks = races["tick"]
+    else:
+        num_races = 1
+        race = race_engine.new_race(num_tortoises, float("inf"), rules, random.Random(seed))
+        start = _perf_counter()
+        race_engine.run(race, max_ticks=frames)
+        ticks = race["tick"]
+    elapsed = _perf_counter() - start
+    return {
+        "backend": backend,
+        "variant": variant,
+        "tortoises": num_tortoises,
+        "races": num_races,
+        "frames": ticks,
+        "ticks_per_sec": ticks / elapsed,
+        "tortoise_ticks_per_sec": ticks * num_races * num_tortoises / elapsed,
+    }
+
+
+def run_placings(variant, num_tortoises, time_step, seed=0):
+    """Run whole races of the NumPy backend, time_step frames per step.
+
+    Returns the result and the share of the races where every lane got every place,
+    the place 0 being no place (exploded, or beaten in a single winner race).
+    """
+    rules = race_engine.VARIANTS[variant]
+    num_races = max(1, PLACING_CELLS // num_tortoises)
+    races = race_numpy.new_races(num_races, num_tortoises, PLACING_FINISH_LINE, rules, seed, time_step)
+    start = _perf_counter()
+    places = race_numpy.run(races)
+    elapsed = _perf_counter() - start
+    shares = np.stack([(places == place).mean(axis=0) for place in range(num_tortoises + 1)], axis=1)
+    first = races["first_finish_tick"]
+    return {
+        "variant": variant,
+        "tortoises": num_tortoises,
+        "races": num_races,
+        "time_step": time_step,
+        "races_per_sec": num_races / elapsed,
+        "first_finish_tick": float(first[first >= 0].mean()) if (first >= 0).any() else None,
+        "exploded": float(races["exploded"].sum(axis=1).mean()),
+        "lane_bias": float(np.abs(shares[:, 1] - shares[:, 1].mean()).max()),
+    }, shares
+
+
+def placing_distance(shares, reference):
+    return float(np.abs(shares - reference).sum(axis=1).mean() / 2)
+
+
+def run_placings_suite(variants, fields, time_steps, seed=0):
+    results = []
+    for variant in variants:
+        for num_tortoises in fields:
+            _, reference = run_placings(variant, num_tortoises, 1, seed)
+            _, shares = run_placings(variant, num_tortoises, 1, seed + 1)
+            noise = placing_distance(shares, reference)
+            for k, time_step in enumerate(time_steps):
+                # Another seed for every run
+                result, shares = run_placings(variant, num_tortoises, time_step, seed + 2 + k)
+                result["placing_distance"] = placing_distance(shares, reference)
+                result["placing_noise"] = noise
+                result["placing_ok"] = result["placing_distance"] <= noise + PLACING_TOLERANCE
+                first = result["first_finish_tick"]
+                print(
+                    f"{variant:<7}{num_tortoises:>6} x{result['races']:<6} step{time_step:>4}"
+                    f"{result['races_per_sec']:>10.0f} races/s  distance{result['placing_distance']:>7.4f}"
+                    f" (noise{noise:>7.4f}, {'ok' if result['placing_ok'] else 'FAILED'})"
+                    f"  lane bias{result['lane_bias']:>7.4f}  first finish{first if first is None else round(first, 1):>7}"
+                    f"  exploded{result['exploded']:>6.2f}",
+                    file=sys.stderr,
+                )
+                results.append(result)
+    return results
+
+
+def _state(race):
+    # What the screen and the results show of a race, the positions aside as they are stored rounded,
+    # and the exploded tortoises in lane order as a replay has them
+    return race["tick"], race["first_finish_tick"], race["over"], list(race["finished"]), sorted(race["exploded"]), list(race["active"])
+
+
+def run_replay(variant, num_tortoises, path, seed=0):
+    """Record a race of the engine as the game does, then play the replay back.
+
+    Returns whether the race ended on its timeout and whether the replay matches it at every tick.
+    """
+    race = race_engine.new_race(num_tortoises, REPLAY_FINISH_LINE, race_engine.VARIANTS[variant], random.Random(seed))
+    recorder = ReplayRecorder(path, race, seed, [str(i) for i in range(num_tortoises)])
+    states = [_state(race)]
+    while not race["over"]:
+        race_engine.step(race)
+        recorder.record(race)
+        states.append(_state(race))
+    recorder.close()
+
+    player = ReplayPlayer(path)
+    replayed = [_state(player.advance())]
+    while player.advance() is not None:
+        replayed.append(_state(player.race))
+    return race_engine.time_left(race) == 0, replayed == states
+
+
+def run_replay_suite(variants, fields, seed=0):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "race.replay")
+        for variant in variants:
+            for num_tortoises in fields:
+                timed_out = mismatches = 0
+                for k in range(REPLAY_RACES):
+                    timeout, same = run_replay(variant, num_tortoises, path, seed + k)
+                    timed_out += timeout
+                    mismatches += not same
+                print(
+                    f"{variant:<7}{num_tortoises:>6} x{REPLAY_RACES:<6} timed out{timed_out:>6}"
+                    f"  mismatches{mismatches:>6} ({'ok' if not mismatches else 'FAILED'})",
+                    file=sys.stderr,
+                )
+                results.append({"variant": variant, "tortoises": num_tortoises, "races": REPLAY_RACES,
+                                "timed_out": timed_out, "mismatches": mismatches})
+    return results
+
+
+def run_suite(variants, fields, terminals, frames=FRAMES, seed=0, snapshot=False):
+    """Run every case in its own process, so that the variants cannot affect each other."""
+    results = []
+    cases = []
+    for variant in variants:
+        sized = SCRIPTS[variant][1]
+        for num_tortoises in fields if sized else [5]:
+            for terminal in terminals:
+                size = terminal_size(terminal, num_tortoises)
+                if (variant, num_tortoises, size) not in cases:
+                    cases.append((variant, num_tortoises, size))
+
+    with tempfile.TemporaryDirectory() as workdir:  # v4.2 saves its results in the current directory
+        for variant, num_tortoises, (height, width) in cases:
+            command = [
+                sys.executable, os.path.abspath(__file__), "--case", variant, str(num_tortoises),
+                str(height), str(width), "--frames", str(frames), "--seed", str(seed),
+            ] + (["--snapshots"] if snapshot else [])
+            process = subprocess.run(command, cwd=workdir, capture_output=True, text=True)
+            if process.returncode:
+                result = {"variant": variant, "tortoises": num_tortoises, "terminal": [height, width],
+                          "error": process.stderr.strip().splitlines()[-1]}
+            else:
+                result = json.loads(process.stdout)
+            print(format_result(result, results), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def run_unified_suite(variants, fields, terminals, frames=FRAMES, seed=0):
+    """Run every variant with its own game loop, then its rules on race_engine, for the same frames."""
+    variants = [variant for variant in variants if variant in race_engine.VARIANTS]
+    results = run_suite(variants, fields, terminals, frames, seed)
+    engines = {}
+    for own in results:
+        case = (own["variant"], own["tortoises"])
+        if case not in engines:
+            engines[case] = run_engine("python", own["variant"], own["tortoises"], frames, seed)
+        engine = engines[case]
+        own["engine_ticks_per_sec"] = engine["ticks_per_sec"]
+        if own.get("ticks_per_sec"):
+            print(
+                f"{own['variant']:<7}{own['tortoises']:>6} {own['terminal'][0]:>6}x{own['terminal'][1]:<4}"
+                f"{own['ticks_per_sec']:>11.0f} ticks/s own loop{engine['ticks_per_sec']:>11.0f} ticks/s engine"
+                f"{engine['ticks_per_sec'] / own['ticks_per_sec']:>8.2f}x",
+                file=sys.stderr,
+            )
+    return results
+
+
+def run_engine_suite(variants, fields, backends, frames=ENGINE_FRAMES, seed=0):
+    results = []
+    for backend in backends:
+        for variant in variants:
+            for num_tortoises in fields:
+                result = run_engine(backend, variant, num_tortoises, frames, seed)
+                print(
+                    f"{backend:<7}{variant:<7}{num_tortoises:>6} x{result['races']:<6}"
+                    f"{result['ticks_per_sec']:>11.0f} ticks/s{result['tortoise_ticks_per_sec'] / 1e6:>9.2f} M tortoise-ticks/s",
+                    file=sys.stderr,
+                )
+                results.append(result)
+    return results
+
+
+def format_result(result, results=()):
+    """One line summary of a case, compared with the stable release on the same case."""
+    case = f"{result['variant']:<7}{result['tortoises']:>6} {result['terminal'][0]:>6}x{result['terminal'][1]:<4}"
+    if result.get("frames") is None or (result["error"] and not result["frames"]):
+        return f"{case}  {result['error']}"
+    ticks = "-" if result["ticks_per_sec"] is None else f"{result['ticks_per_sec']:.0f}"
+    line = (
+        f"{case}{ticks:>11} ticks/s{result['render_ms_per_frame']:>9.3f} ms"
+        f"{result['bytes_per_frame']:>11.0f} B{result['peak_memory_kb']:>9} KB"
+    )
+    for other in results:
+        if other["variant"] == "stable" and other.get("ticks_per_sec") and result["ticks_per_sec"] and \
+                (other["tortoises"], other["terminal"]) == (result["tortoises"], result["terminal"]):
+            line += (
+                f"   vs stable: {result['ticks_per_sec'] / other['ticks_per_sec']:.2f}x ticks/s,"
+                f" {result['bytes_per_frame'] / max(other['bytes_per_frame'], 1):.2f}x bytes"
+            )
+    if result["error"]:
+        line += f"  ({result['error']})"
+    return line
+
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every variant of the game, headless")
+    parser.add_argument("--variants", nargs="+", choices=SCRIPTS, default=list(SCRIPTS), help="Variants to run (default: all)")
+    parser.add_argument("--fields", nargs="+", type=int, default=FIELDS, help="Numbers of tortoises (default: 5 50 500 5000)")
+    parser.add_argument("--terminals", nargs="+", default=TERMINALS, help="Terminal sizes, HEIGHTxWIDTH or fit (default: 24x80 50x160 fit)")
+    parser.add_argument("--frames", type=int, default=None,
+                        help=f"Frames measured in every run (default: {FRAMES}, {ENGINE_FRAMES} with --headless)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the races (default: 0)")
+    parser.add_argument("--snapshots", action="store_true", help="Save the text of the last frame of every run")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file of the results (default: benchmark.json)")
+    parser.add_argument("--headless", action="store_true", help="Measure the race engines alone instead of the scripts")
+    parser.add_argument("--backends", nargs="+", choices=["python", "numpy"], default=["python", "numpy"],
+                        help="Engines measured with --headless (default: python numpy)")
+    parser.add_argument("--time_steps", nargs="+", type=int, default=None,
+                        help="Compare the finishing distributions of the NumPy backend at these frames per step, 1 for the noise (e.g. 1 4 16)")
+    parser.add_argument("--replays", action="store_true",
+                        help=f"Record {REPLAY_RACES} races of the engine for every case and compare their replays with them")
+    parser.add_argument("--unified", action="store_true",
+                        help="Compare the game loop of every variant with race_engine running its rules")
+    parser.add_argument("--case", nargs=4, default=None, help=argparse.SUPPRESS)  # Used by the suite to run one case
+    args = parser.parse_args()
+    frames = args.frames or (ENGINE_FRAMES if args.headless else FRAMES)
+
+    if args.case:
+        variant, num_tortoises, height, width = args.case
+        print(json.dumps(run_case(variant, int(num_tortoises), int(height), int(width), frames, args.seed, args.snapshots)))
+    else:
+        if args.time_steps:
+            if race_numpy is None:
+                sys.exit("--time_steps needs NumPy")
+            variants = [variant for variant in args.variants if variant in race_engine.VARIANTS]
+            results = run_placings_suite(variants, args.fields, args.time_steps, args.seed)
+        elif args.replays:
+            variants = [variant for variant in args.variants if variant in race_engine.VARIANTS]
+            results = run_replay_suite(variants, args.fields, args.seed)
+        elif args.unified:
+            results = run_unified_suite(args.variants, args.fields, args.terminals, frames, args.seed)
+        elif args.headless:
+            variants = [variant for variant in args.variants if variant in race_engine.VARIANTS]
+            backends = [backend for backend in args.backends if backend == "python" or race_numpy]
+            results = run_engine_suite(variants, args.fields, backends, frames, args.seed)
+        else:
+            results = run_suite(args.variants, args.fields, args.terminals, frames, args.seed, args.snapshots)
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "frames": frames,
+            "seed": args.seed,
+            "results": results,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print(f"Results saved to {args.output}", file=sys.stderr)
+        if not all(result.get("placing_ok", True) for result in results):
+            sys.exit(f"The placings depend on the time step by more than {PLACING_TOLERANCE} above the noise.")
+        if any(result.get("mismatches") for result in results):
+            sys.exit("Some replays differ from their races.")
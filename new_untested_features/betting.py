@@ -0,0 +1,531 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import statistics
+import time
+import uuid
+
+import race_engine
+import race_events
+import sqlite_wal
+
+# Betting service: bets come from any number of local clients over a socket, one JSON
+# object per line, and are settled against the finishing order of the race. The pools
+# are pari-mutuel: once the house has taken its share, a pool goes to the bettors who
+# backed the tortoises that came in, in proportion to their stakes.
+#
+#   win    first place
+#   place  first two places
+#   show   first three places, place and show only when the whole field is ranked
+#
+# The game (or any operator) opens a book for a race, locks it when the race starts
+# ("READY!") and settles it with the finishing order, or voids it and refunds every
+# stake if the race does not run to its end. Amounts are integers, in cents.
+# Those requests and the deposits carry the operator key of the service, the bettors
+# can only bet and look at their balance and the book.
+#
+# Every change of a balance is an entry of the ledger, a SQLite file in WAL mode. The
+# balances are kept in memory and checked at once, the entries are written in batches,
+# one transaction every few milliseconds for all the clients (group commit), and a
+# request is only answered once its entries are on disk. If a batch cannot be written
+# the service stops, and the balances are read again from the ledger when it starts
+# again. A book left open by a crash is refunded then.
+#
+#   wallets  wallet, balance
+#   entries  entry_id, wallet, race_id, kind (deposit, stake, payout, refund, take),
+#            amount (change of the balance), pool, tortoise, created_at
+#   books    race_id, names, pools, opened_at, locked_at, settled_at, finishing order
+
+DEFAULT_PATH = "ledger.db"
+PORT = 8766
+HOUSE = "house"  # Wallet of the share taken by the house, and of the cents left by the rounding
+TAKE = 0.1  # Share of every pool kept by the house
+FLUSH_INTERVAL = 0.005  # Seconds between two writes of the ledger
+BUSY_TIMEOUT = 30
+POOLS = {"win": 1, "place": 2, "show": 3}  # Places paid by every pool
+OPERATOR_REQUESTS = ("deposit", "open", "lock", "settle", "void")
+KEY_VARIABLE = "TORTOISE_BETS_KEY"  # Environment variable of the operator key
+LINE_LIMIT = 2**24  # Bytes of a request, the names and the finishing order of a field of 10,000+ tortoises
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS wallets (
+    wallet TEXT PRIMARY KEY,
+    balance INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entries (
+    entry_id INTEGER PRIMARY KEY,
+    wallet TEXT NOT NULL,
+    race_id TEXT,
+    kind TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    pool TEXT,
+    tortoise INTEGER,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS books (
+    race_id TEXT PRIMARY KEY,
+    names TEXT NOT NULL,
+    pools TEXT NOT NULL,
+    opened_at REAL NOT NULL,
+    locked_at REAL,
+    settled_at REAL,
+    finishing_order TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_by_wallet ON entries (wallet, entry_id);
+CREATE INDEX IF NOT EXISTS entries_by_race ON entries (race_id, kind);
+"""
+
+
+class Ledger:
+    """Wallet balances in memory, and their entries written to SQLite in batches.
+
+    post() changes a balance at once and returns a future that is done once the
+    entry is on disk. All the entries posted during FLUSH_INTERVAL go in the same
+    transaction, written in a thread so that the event loop keeps taking requests.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        # FULL: a batch is synced to disk before its requests are answered, even a power failure cannot lose it
+        self.connection = sqlite_wal.connect(path, BUSY_TIMEOUT, "FULL", check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.balances = dict(self.connection.execute("SELECT wallet, balance FROM wallets"))
+        self._next_id = self.connection.execute("SELECT coalesce(max(entry_id), 0) + 1 FROM entries").fetchone()[0]
+        self._entries = []
+        self._books = []
+        self._touched = set()
+        self._waiters = []
+        self._flushing = None
+        self.failure = None  # Error of the batch that could not be written, the balances no longer match the ledger
+        self.failed = asyncio.Event()
+
+    def post(self, wallet, amount, kind, race_id=None, pool=None, tortoise=None):
+        """Change the balance of a wallet by amount, return the id of the entry and the future of its write."""
+        balance = self.balances.get(wallet, 0) + amount
+        if balance < 0:
+            raise ValueError(f"Insufficient funds: the balance of {wallet} is {balance - amount}.")
+        self.balances[wallet] = balance
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries.append((entry_id, wallet, race_id, kind, amount, pool, tortoise, time.time()))
+        self._touched.add(wallet)
+        return entry_id, self._written()
+
+    def record_book(self, book):
+        """Save the state of a book with the next batch, return the future of its write."""
+        self._books.append((book.race_id, json.dumps(book.names), json.dumps(list(book.pools)), book.opened_at,
+                            book.locked_at, book.settled_at, None if book.order is None else json.dumps(book.order)))
+        return self._written()
+
+    def _written(self):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        if self._flushing is None:
+            self._flushing = asyncio.ensure_future(self._flush_later())
+        return future
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            pass  # The service stops on it, see serve()
+        finally:
+            self._flushing = None
+            if self.failure is not None:
+                # Posted while the batch was written, on balances that included it
+                for future in self._waiters:
+                    future.set_exception(self.failure)
+                self._waiters = []
+            elif self._waiters:  # Posted while the batch was written
+                self._flushing = asyncio.ensure_future(self._flush_later())
+
+    async def flush(self):
+        """Write the entries posted so far in one transaction, then resolve their futures."""
+        entries, books, waiters = self._entries, self._books, self._waiters
+        balances = [(wallet, self.balances[wallet]) for wallet in self._touched]
+        self._entries, self._books, self._waiters, self._touched = [], [], [], set()
+        try:
+            await asyncio.to_thread(self._write, entries, balances, books)
+        except BaseException as e:
+            for future in waiters:
+                future.set_exception(e)
+            if isinstance(e, Exception):
+                self.failure = e
+                self.failed.set()
+            raise
+        for future in waiters:
+            future.set_result(None)
+
+    def _write(self, entries, balances, books):
+        with sqlite_wal.transaction(self.connection):
+            self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+            self.connection.executemany("INSERT OR REPLACE INTO wallets VALUES (?, ?)", balances)
+            self.connection.executemany("INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?)", books)
+
+    def refund_open_books(self):
+        """Give back the stakes of the books a crash left open, in one transaction, and return how many."""
+        stakes = self.connection.execute(
+            "SELECT entries.race_id, wallet, -sum(amount) FROM entries JOIN books USING (race_id)"
+            " WHERE kind = 'stake' AND settled_at IS NULL GROUP BY entries.race_id, wallet"
+        ).fetchall()
+        now = time.time()
+        entries = []
+        for race_id, wallet, stake in stakes:
+            self.balances[wallet] = self.balances.get(wallet, 0) + stake
+            entries.append((self._next_id, wallet, race_id, "refund", stake, None, None, now))
+            self._next_id += 1
+        with sqlite_wal.transaction(self.connection):
+            self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+            self.connection.executemany("INSERT OR REPLACE INTO wallets VALUES (?, ?)",
+                                        [(wallet, self.balances[wallet]) for _, wallet, _ in stakes])
+            self.connection.execute("UPDATE books SET settled_at = ? WHERE settled_at IS NULL", (now,))
+        return len(stakes)
+
+    async def close(self):
+        if self._flushing is not None:
+            await self._flushing
+        await self.flush()
+        self.connection.close()
+
+
+class Book:
+    """Bets of one race, by pool and tortoise, from opening to settlement."""
+
+    def __init__(self, race_id, names, pools):
+        self.race_id = race_id
+        self.names = names
+        self.pools = {pool: [{} for _ in names] for pool in pools}  # Stake of every wallet, by tortoise
+        self.opened_at = time.time()
+        self.locked_at = None
+        self.settled_at = None
+        self.order = None
+
+    @property
+    def state(self):
+        if self.settled_at is not None:
+            return "void" if self.order is None else "settled"
+        return "open" if self.locked_at is None else "locked"
+
+    def add(self, wallet, pool, tortoise, stake):
+        backers = self.pools[pool][tortoise]
+        backers[wallet] = backers.get(wallet, 0) + stake
+
+    def stakes(self):
+        """(wallet, stake, pool, tortoise) of every bet, the stakes of a wallet on the same tortoise and pool summed."""
+        return [(wallet, stake, pool, i) for pool, tortoises in self.pools.items()
+                for i, backers in enumerate(tortoises) for wallet, stake in backers.items()]
+
+    def totals(self):
+        """Total stake of every pool, by tortoise."""
+        return {pool: [sum(backers.values()) for backers in tortoises] for pool, tortoises in self.pools.items()}
+
+    def payouts(self, order, take=TAKE):
+        """(wallet, amount, pool, tortoise) of the payouts for a finishing order, and the share of the house.
+
+        The profit of a pool, what is left once the house took its share and the
+        winning stakes are paid back, is split evenly between the tortoises that came
+        in and backed, then between their backers in proportion to their stakes. A
+        pool where nobody backed a winner is refunded. Cents lost to the rounding go
+        to the house.
+        """
+        payouts = []
+        house = 0
+        for pool, tortoises in self.pools.items():
+            total = sum(sum(backers.values()) for backers in tortoises)
+            if not total:
+                continue
+            placed = [i for i in order[:POOLS[pool]] if tortoises[i]]
+            if not placed:
+                payouts += [(wallet, stake, pool, i) for i, backers in enumerate(tortoises) for wallet, stake in backers.items()]
+                continue
+            winning = sum(sum(tortoises[i].values()) for i in placed)
+            profit = max(0, int(total * (1 - take)) - winning)
+            paid = 0
+            for i in placed:
+                share = profit // len(placed)
+                stakes = sum(tortoises[i].values())
+                for wallet, stake in tortoises[i].items():
+                    amount = stake + share * stake // stakes
+                    payouts.append((wallet, amount, pool, i))
+                    paid += amount
+            house += total - paid
+        return payouts, house
+
+
+class BettingServer:
+    """Take bets for the book of the current race, and settle it against the finishing order."""
+
+    def __init__(self, ledger, key, take=TAKE):
+        self.ledger = ledger
+        self.key = key.encode()  # Operator key
+        self.take = take
+        self.book = None
+        self.bets = 0  # Bets taken since the start
+
+    async def handle(self, reader, writer):
+        """Connection of a client: its requests are carried out in order and answered in order."""
+        answers = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send(writer, answers))
+        try:
+            while line := await reader.readline():
+                try:
+                    answers.put_nowait(self.apply(json.loads(line)))
+                except (ValueError, KeyError, TypeError) as e:
+                    answers.put_nowait(({"ok": False, "error": str(e)}, None))
+        except ConnectionError:
+            pass
+        finally:
+            answers.put_nowait(None)
+            await sender
+            writer.close()
+
+    async def _send(self, writer, answers):
+        # Answers wait for their entries to be on disk, without holding the next requests back
+        while (answer := await answers.get()) is not None:
+            response, written = answer
+            if written is not None:
+                try:
+                    await written
+                except Exception as e:
+                    response = {"ok": False, "error": f"The ledger could not be written: {e}"}
+            writer.write(json.dumps(response).encode() + b"\n")
+            if answers.empty():
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+    def apply(self, request):
+        """Carry out a request at once, return its response and the future of its write to the ledger, or None."""
+        op = request["op"]
+        ledger = self.ledger
+        if ledger.failure is not None:
+            raise ValueError("The ledger could not be written, the service is stopping.")
+        if op in OPERATOR_REQUESTS and not secrets.compare_digest(str(request.get("key")).encode(), self.key):
+            raise ValueError(f"Only the operator can {op}.")
+        if op == "bet":
+            book = self.book
+            if book is None or book.state != "open":
+                raise ValueError("No book is open.")
+            pool, tortoise, stake = request["pool"], request["tortoise"], request["stake"]
+            if pool not in book.pools:
+                raise ValueError(f"The pools of this race are {', '.join(book.pools)}.")
+            if not isinstance(tortoise, int) or not 0 <= tortoise < len(book.names):
+                raise ValueError(f"Tortoises are numbered from 0 to {len(book.names) - 1}.")
+            if not isinstance(stake, int) or stake <= 0:
+                raise ValueError("The stake must be a positive number of cents.")
+            entry_id, written = ledger.post(request["wallet"], -stake, "stake", book.race_id, pool, tortoise)
+            book.add(request["wallet"], pool, tortoise, stake)
+            self.bets += 1
+            return {"ok": True, "bet_id": entry_id, "balance": ledger.balances[request["wallet"]]}, written
+        if op == "balance":
+            return {"ok": True, "balance": ledger.balances.get(request["wallet"], 0)}, None
+        if op == "deposit":
+            if not isinstance(request["amount"], int) or request["amount"] <= 0:
+                raise ValueError("The amount must be a positive number of cents.")
+            _, written = ledger.post(request["wallet"], request["amount"], "deposit")
+            return {"ok": True, "balance": ledger.balances[request["wallet"]]}, written
+        if op == "book":
+            if self.book is None:
+                return {"ok": True, "state": None}, None
+            book = self.book
+            return {"ok": True, "race_id": book.race_id, "names": book.names, "state": book.state,
+                    "totals": book.totals(), "order": book.order}, None
+
+        # Operator requests, from the game
+        if op == "open":
+            if self.book is not None and self.book.state in ("open", "locked"):
+                raise ValueError(f"The book of race {self.book.race_id} is not settled.")
+            ranked = request.get("ranked", True)
+            pools = [pool for pool, places in POOLS.items() if pool == "win" or (ranked and places < len(request["names"]))]
+            self.book = Book(request.get("race_id") or uuid.uuid4().hex, request["names"], pools)
+            return {"ok": True, "race_id": self.book.race_id, "pools": pools}, ledger.record_book(self.book)
+        if op == "lock":
+            if self.book is None or self.book.state != "open":
+                raise ValueError("No book is open.")
+            self.book.locked_at = time.time()
+            return {"ok": True, "totals": self.book.totals()}, ledger.record_book(self.book)
+        if op == "settle":
+            book = self.book
+            if book is None or book.state != "locked":
+                raise ValueError("Lock the book before settling it.")
+            order = request["order"]
+            if len(set(order)) != len(order) or not all(isinstance(i, int) and 0 <= i < len(book.names) for i in order):
+                raise ValueError("The finishing order must hold distinct tortoise numbers.")
+            payouts, house = book.payouts(order, self.take)
+            for wallet, amount, pool, tortoise in payouts:
+                ledger.post(wallet, amount, "payout", book.race_id, pool, tortoise)
+            if house:
+                ledger.post(HOUSE, house, "take", book.race_id)
+            book.order = order
+            book.settled_at = time.time()
+            return {"ok": True, "payouts": len(payouts), "paid": sum(amount for _, amount, _, _ in payouts),
+                    "house": house}, ledger.record_book(book)
+        if op == "void":
+            # The race did not run to its end: every stake goes back, in the same batch as the book
+            book = self.book
+            if book is None or book.state not in ("open", "locked"):
+                raise ValueError("No book is open or locked.")
+            refunds = book.stakes()
+            for wallet, stake, pool, tortoise in refunds:
+                ledger.post(wallet, stake, "refund", book.race_id, pool, tortoise)
+            book.settled_at = time.time()
+            return {"ok": True, "refunds": len(refunds),
+                    "refunded": sum(stake for _, stake, _, _ in refunds)}, ledger.record_book(book)
+        raise ValueError(f"Unknown request {op!r}.")
+
+
+async def serve(server, host="127.0.0.1", port=PORT, path=None):
+    refunded = server.ledger.refund_open_books()
+    if refunded:
+        print(f"{refunded} stakes of unsettled books refunded")
+    if path:
+        listener = await asyncio.start_unix_server(server.handle, path, limit=LINE_LIMIT)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port, limit=LINE_LIMIT)
+    async with listener:
+        await server.ledger.failed.wait()  # Until a batch cannot be written: the balances in memory are wrong then
+    raise ValueError(f"The ledger could not be written, the service stopped: {server.ledger.failure}")
+
+
+class BettingClient:
+    """Blocking connection to the betting service, for the game. The operator requests need the key of the service."""
+
+    def __init__(self, address, key=None):
+        self.key = key
+        host, _, port = address.rpartition(":")
+        try:
+            self.socket = socket.create_connection((host or "127.0.0.1", int(port)))
+        except OSError as e:
+            raise ValueError(f"Cannot reach the betting service at {address}: {e}")
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, op, **fields):
+        if self.key is not None:
+            fields["key"] = self.key
+        self.file.write(json.dumps(dict(fields, op=op)).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        return response
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+# Stand-in clients for a load test: every client pipelines its bets, WINDOW of them
+# waiting for an answer at most, for as long as the book is open
+
+WINDOW = 8
+STARTING_BALANCE = 10**9
+
+
+async def _bettor(host, port, wallet, names, pools, deadline, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    rng = random.Random(wallet)
+    sent = []  # Send times of the bets waiting for an answer
+    rejected = 0
+
+    async def read_answers(count):
+        nonlocal rejected
+        for _ in range(count):
+            answer = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent.pop(0))
+            rejected += not answer["ok"]
+
+    while time.perf_counter() < deadline:
+        for _ in range(WINDOW - len(sent)):
+            bet = {"op": "bet", "wallet": wallet, "pool": rng.choice(pools), "tortoise": rng.randrange(len(names)),
+                   "stake": rng.randint(1, 100) * 100}
+            writer.write(json.dumps(bet).encode() + b"\n")
+            sent.append(time.perf_counter())
+        await read_answers(max(1, len(sent) // 2))
+    await read_answers(len(sent))
+    writer.close()
+    return rejected
+
+
+async def load_test(host, port, key, clients, duration, num_tortoises, rules, seed=None):
+    """Run one race of bets against the service, return the results of the test."""
+    operator = BettingClient(f"{host}:{port}", key)
+    seed = random.randrange(2**32) if seed is None else seed
+    names = [f"Tortoise {i + 1}" for i in range(num_tortoises)]
+    wallets = [f"load-{seed}-{k}" for k in range(clients)]
+    for wallet in wallets:
+        operator.request("deposit", wallet=wallet, amount=STARTING_BALANCE)
+    house = operator.request("balance", wallet=HOUSE)["balance"]
+    opened = operator.request("open", names=names, ranked=not rules["single_winner"])
+
+    latencies = []
+    start = time.perf_counter()
+    rejected = await asyncio.gather(*[
+        _bettor(host, port, wallet, names, opened["pools"], start + duration, latencies) for wallet in wallets
+    ])
+    elapsed = time.perf_counter() - start
+    totals = operator.request("lock")["totals"]
+
+    # The race itself, headless and never shown: it jumps straight to its results
+    race = race_engine.new_race(num_tortoises, 70, rules, random.Random(seed))
+    race_events.finish(race)
+    settled = operator.request("settle", order=race["finished"])
+
+    # Nothing is created or lost: the stakes went back to the wallets or to the house
+    balances = [operator.request("balance", wallet=wallet)["balance"] for wallet in wallets]
+    house = operator.request("balance", wallet=HOUSE)["balance"] - house
+    operator.close()
+    staked = sum(sum(stakes) for stakes in totals.values())
+    latencies.sort()
+    return {
+        "bets": len(latencies),
+        "rejected": sum(rejected),
+        "bets_per_sec": len(latencies) / elapsed,
+        "latency_ms_p50": latencies[len(latencies) // 2] * 1e3,
+        "latency_ms_p99": latencies[int(len(latencies) * 0.99)] * 1e3,
+        "latency_ms_mean": statistics.fmean(latencies) * 1e3,
+        "staked": staked,
+        "paid": settled["paid"],
+        "house": house,
+        "balanced": sum(balances) + house == clients * STARTING_BALANCE,
+    }
+
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tortoise Rush betting service")
+    parser.add_argument("--db", default=DEFAULT_PATH, help=f"Ledger database (default: {DEFAULT_PATH})")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the service (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=PORT, help=f"TCP port of the service (default: {PORT})")
+    parser.add_argument("--unix", default=None, help="Path of a Unix socket to use instead of TCP")
+    parser.add_argument("--key", default=os.environ.get(KEY_VARIABLE),
+                        help=f"Operator key of the service, to open, lock and settle the books and to deposit (default: ${KEY_VARIABLE}, or a new one)")
+    parser.add_argument("--take", type=float, default=TAKE, help=f"Share of every pool kept by the house (default: {TAKE})")
+    parser.add_argument("--load_test", action="store_true", help="Bet against a running service with stand-in clients")
+    parser.add_argument("--clients", type=int, default=50, help="Stand-in clients of the load test (default: 50)")
+    parser.add_argument("--duration", type=float, default=5, help="Seconds the book stays open in the load test (default: 5)")
+    parser.add_argument("--num_tortoises", type=int, default=5, help="Number of tortoises of the load test race (default: 5)")
+    parser.add_argument("--rules", choices=race_engine.VARIANTS, default="stable", help="Rules of the load test race (default: stable)")
+    args = parser.parse_args()
+
+    try:
+        if args.load_test:
+            result = asyncio.run(load_test(args.host, args.port, args.key, args.clients, args.duration, args.num_tortoises,
+                                           race_engine.VARIANTS[args.rules]))
+            print(json.dumps(result, indent=2))
+        else:
+            key = args.key
+            if key is None:
+                key = secrets.token_hex(16)
+                print(f"Operator key: {key}", flush=True)
+            asyncio.run(serve(BettingServer(Ledger(args.db), key, args.take), args.host, args.port, args.unix))
+    except ValueError as e:
+        print(str(e))
+    except KeyboardInterrupt:
+        pass
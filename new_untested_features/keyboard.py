@@ -0,0 +1,51 @@
+import curses
+import selectors
+import sys
+import time
+
+ESCAPE_DELAY = 25  # Milliseconds curses waits for the rest of an escape sequence, 1000 by default
+
+# Keys typed during a race, read without ever waiting for them. A selector watches the
+# terminal: the loop sleeps in wait() until its next tick or frame is due, and wakes up
+# as soon as a key is typed to read it, so nothing is typed ahead and lost, and the
+# keys take effect in the frame that follows. On a window that is not a terminal, like
+# the virtual screen of the benchmark, wait() is a plain sleep.
+
+
+class Keyboard:
+    """Keys typed on a curses window, collected between frames."""
+
+    def __init__(self, stdscr, file=sys.stdin):
+        self.stdscr = stdscr
+        self._pending = []
+        self._selector = None
+        stdscr.nodelay(True)
+        if isinstance(stdscr, curses.window):
+            if hasattr(curses, "set_escdelay"):
+                curses.set_escdelay(ESCAPE_DELAY)  # A lone Esc would hold getch() for a second
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(file, selectors.EVENT_READ)
+
+    def _read(self):
+        key = self.stdscr.getch()
+        while key != -1:
+            self._pending.append(key)
+            key = self.stdscr.getch()
+
+    def keys(self):
+        """The keys typed since the last call, oldest first, without waiting."""
+        self._read()  # Also picks up KEY_RESIZE, which comes from a signal and not from the terminal
+        keys, self._pending = self._pending, []
+        return keys
+
+    def wait(self, seconds):
+        """Sleep for seconds, or less if a key is typed."""
+        if self._selector is None:
+            time.sleep(seconds)
+        elif self._selector.select(seconds):
+            self._read()
+
+    def close(self):
+        self.stdscr.nodelay(False)
+        if self._selector is not None:
+            self._selector.close()
@@ -0,0 +1,54 @@
+from viewport import Viewport
+
+# Geometry of the race on screen, computed from the size of the terminal and again
+# whenever it changes. The race itself never changes: positions are in columns of the
+# track the race was created with, and the layout scales them to the columns of the
+# track on screen.
+
+FINISH_MARGIN = 10  # Columns right of the finish line, for the places
+MIN_ROWS = 8  # Rows of a terminal needed to scroll through a field
+FIRST_ROW = 2  # Row of the first lane, the timer is above
+
+
+class Layout:
+    """Rows of the lanes, column of the finish line and scale of the track, for one terminal size."""
+
+    def __init__(self, num_lanes, finish_line, height, width, viewport=False):
+        self.num_lanes = num_lanes
+        self.finish_line = finish_line  # Of the race, in columns of its own track
+        self.force_viewport = viewport
+        self.viewport = None
+        self.height = self.width = None
+        self.resize(height, width)
+
+    def resize(self, height, width):
+        """Lay the race out on a terminal of the new size.
+
+        Returns True if the scenery has to be drawn again: the lanes moved or the
+        track changed length. The lanes on screen, or following the leaders, are kept.
+        """
+        old = self.viewport
+        if old is None and width <= FINISH_MARGIN:
+            raise ValueError("The terminal width is too small for the race.")
+        scenery = width != self.width
+        self.height, self.width = height, width
+        self.finish_column = max(1, width - FINISH_MARGIN)
+        self.scale = self.finish_column / self.finish_line
+
+        # Two rows per lane when the whole field fits, otherwise one row per lane and scrolling
+        if not self.force_viewport and FIRST_ROW + self.num_lanes * 2 <= height - 1:
+            self.viewport = Viewport(self.num_lanes, self.num_lanes * 2)
+        else:
+            if old is None and height < MIN_ROWS:
+                raise ValueError("The terminal height is too small for the race.")
+            self.viewport = Viewport(self.num_lanes, max(1, height - 4), lane_height=1)
+        if old is not None:
+            viewport = self.viewport
+            viewport.top = max(0, min(old.top, self.num_lanes - viewport.size))
+            viewport.follow, viewport.track = old.follow, old.track
+            scenery = scenery or self.viewport.lane_height != old.lane_height
+        return scenery
+
+    def column(self, x):
+        """Column on screen of position x of the race."""
+        return int(x * self.scale)
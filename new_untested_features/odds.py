@@ -0,0 +1,137 @@
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import race_engine
+import race_events
+
+try:
+    import numpy as np
+    import race_numpy
+except ImportError:  # NumPy is optional, the odds are just computed on fewer races without it
+    race_numpy = None
+
+PODIUM = 3  # Win, place and show: first, first two and first three
+Z_95 = 1.96
+BATCH = 256  # Races simulated side by side by every process...
+BATCH_CELLS = 2**16  # ...but no more tortoises than this in total
+CHECK_EVERY = 10  # Frames between two looks at the clock
+
+
+def _simulate_numpy(num_tortoises, finish_line, rules, deadline, seed):
+    """Simulate races with the NumPy backend until the deadline.
+
+    A batch of races runs side by side and every race whose podium is known is
+    counted and replaced by a new one, so the batch never idles on finished races.
+    """
+    places = 1 if rules["single_winner"] else PODIUM
+    counts = np.zeros((PODIUM, num_tortoises), dtype=np.int64)
+    total = 0
+    batch = max(1, min(BATCH, BATCH_CELLS // num_tortoises))
+    races = race_numpy.new_races(batch, num_tortoises, finish_line, rules, seed)
+    while time.monotonic() < deadline:
+        for _ in range(CHECK_EVERY):
+            race_numpy.step(races)
+
+        done = races["num_finished"] >= places
+        done |= races["over"]
+        if done.any():
+            decided = races["place"][done]
+            for rank in range(PODIUM):
+                counts[rank] += ((decided > 0) & (decided <= rank + 1)).sum(axis=0)
+            total += len(decided)
+            race_numpy.restart(races, done)
+    return total, counts.tolist()
+
+
+def _simulate_python(num_tortoises, finish_line, rules, deadline, seed):
+    """Simulate races one at a time with the event-driven engine until the deadline.
+
+    Every race jumps from one change of acceleration to the next and only runs
+    until its podium is known.
+    """
+    places = 1 if rules["single_winner"] else PODIUM
+    counts = [[0] * num_tortoises for _ in range(PODIUM)]
+    total = 0
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        race = race_engine.new_race(num_tortoises, finish_line, rules, rng)
+        for rank, i in enumerate(race_events.podium(race, places)):
+            for r in range(rank, PODIUM):
+                counts[r][i] += 1
+        total += 1
+    return total, counts
+
+
+def _simulate(num_tortoises, finish_line, rules, deadline, seed):
+    if race_numpy is not None:
+        return _simulate_numpy(num_tortoises, finish_line, rules, deadline, seed)
+    return _simulate_python(num_tortoises, finish_line, rules, deadline, seed)
+
+
+def wilson_interval(hits, total, z=Z_95):
+    """Estimated probability with the bounds of its Wilson score interval."""
+    if total == 0:
+        return 0.0, 0.0, 1.0
+    p = hits / total
+    denominator = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return p, max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+def estimate_odds(num_tortoises, finish_line, rules=race_engine.STABLE_RULES, budget=0.3, workers=None, seed=None):
+    """Estimate the win, place and show probabilities of every tortoise within budget seconds.
+
+    The races are spread over a pool of processes. Every probability comes as a
+    (estimate, low, high) tuple with its 95% confidence interval; place and show
+    are None for the rules where the race stops at the winner.
+    """
+    deadline = time.monotonic() + budget * 0.9  # Keep some time to collect the results
+    workers = workers or os.cpu_count() or 1
+    seed = random.randrange(2**32) if seed is None else seed
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(_simulate, num_tortoises, finish_line, rules, deadline, seed * 1024 + w)
+            for w in range(workers)
+        ]
+        results = [future.result() for future in futures]
+
+    total = sum(races for races, _ in results)
+    counts = [[sum(c[rank][i] for _, c in results) for i in range(num_tortoises)] for rank in range(PODIUM)]
+    odds = {"races": total}
+    for rank, key in enumerate(["win", "place", "show"]):
+        if rank and rules["single_winner"]:
+            odds[key] = None
+        else:
+            odds[key] = [wilson_interval(hits, total) for hits in counts[rank]]
+    return odds
+
+
+def format_odds(odds, i):
+    """One line summary of the odds of tortoise i."""
+    parts = []
+    for key in ["win", "place", "show"]:
+        if odds[key] is not None:
+            p, low, high = odds[key][i]
+            parts.append(f"{key.capitalize()} {p:6.1%} ±{(high - low) / 2:.1%}")
+    return "  ".join(parts)
+
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-race odds of a tortoise race")
+    parser.add_argument("--num_tortoises", type=int, default=5, help="Number of tortoises in the race (default: 5)")
+    parser.add_argument("--finish_line", type=int, default=110, help="Length of the track in columns (default: 110)")
+    parser.add_argument("--rules", choices=race_engine.VARIANTS, default="stable", help="Rules of the race (default: stable)")
+    parser.add_argument("--budget", type=float, default=0.3, help="Time budget in seconds (default: 0.3)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores)")
+    args = parser.parse_args()
+
+    odds = estimate_odds(args.num_tortoises, args.finish_line, race_engine.VARIANTS[args.rules], args.budget, args.workers)
+    print(f"{odds['races']} races simulated")
+    for i in range(args.num_tortoises):
+        print(f"{i + 1:>3}  {format_odds(odds, i)}")
@@ -0,0 +1,445 @@
+import functools
+import heapq
+import math
+import random
+from array import array
+
+# Rules of the stable release (stable/tortoise_rushv4.py).
+# Speeds and accelerations are in columns per frame, one frame lasts "frame_time" seconds.
+STABLE_RULES = {
+    "start_speed": (0.1, 0.1),
+    "start_acceleration": (0, 0),
+    "min_speed": 0,
+    "acceleration_chance": 0.2,  # 20% chance per frame
+    "acceleration_range": (-0.05, 0.025),
+    "frame_time": 0.075,
+    "timeout": 60,  # Seconds left to the others once the first tortoise finishes
+    "single_winner": False,  # Stop at the first tortoise crossing the line instead of ranking them all
+    "bomb_chance": 0,  # Chance per frame that a bomb is placed on a tortoise
+    "bomb_fuse": 3,  # Countdown of a bomb...
+    "bomb_period": 10,  # ...decreased every this many frames
+}
+
+# Rules of the variants in new_untested_features/, by version. v1 and v2 have no finish
+# line, their tortoises go round the screen: race them with a finish line at infinity.
+VARIANTS = {
+    "stable": STABLE_RULES,
+    "v1": dict(
+        STABLE_RULES,
+        start_speed=(0.1, 0.5),
+        acceleration_chance=0,
+        frame_time=0.1,
+        timeout=None,
+    ),
+    "v2": dict(
+        STABLE_RULES,
+        start_speed=(0.1, 0.5),
+        start_acceleration=(-0.02, 0.02),
+        min_speed=0.1,
+        acceleration_chance=0.1,
+        acceleration_range=(-0.02, 0.02),
+        frame_time=0.1,
+        timeout=None,
+    ),
+    "v3": dict(
+        STABLE_RULES,
+        start_speed=(0.5, 1.5),
+        start_acceleration=(-0.05, 0.05),
+        min_speed=0.1,
+        acceleration_chance=0.1,
+        acceleration_range=(-0.05, 0.05),
+        frame_time=0.1,
+        timeout=None,
+        single_winner=True,
+    ),
+    "v4.1": dict(
+        STABLE_RULES,
+        start_speed=(0.1, 0.5),
+        start_acceleration=(-0.05, 0.05),
+        min_speed=0.1,
+        acceleration_range=(-0.05, 0.02),
+        timeout=None,
+        single_winner=True,
+        bomb_chance=0.001,
+    ),
+    "v4.2": dict(
+        STABLE_RULES,
+        start_speed=(0.1, 0.5),
+        start_acceleration=(-0.05, 0.05),
+        min_speed=0.1,
+        acceleration_range=(-0.05, 0.02),
+        timeout=None,
+        bomb_chance=0.0005,
+    ),
+    # v5 counts the bomb down once per frame, after drawing it, so it goes off one frame later
+    "v5": dict(
+        STABLE_RULES,
+        start_speed=(0.1, 0.5),
+        start_acceleration=(-0.05, 0.05),
+        min_speed=0.1,
+        acceleration_range=(-0.05, 0.02),
+        timeout=None,
+        single_winner=True,
+        bomb_chance=0.02,
+        bomb_fuse=4,
+        bomb_period=1,
+    ),
+    "v6": dict(
+        STABLE_RULES,
+        start_speed=(0.5, 1.5),
+        start_acceleration=(-0.05, 0.05),
+        min_speed=0.1,
+        acceleration_chance=0.1,
+        acceleration_range=(-0.05, 0.05),
+        frame_time=0.1,
+        timeout=None,
+        single_winner=True,
+        bomb_chance=0.02,
+    ),
+    "v7": dict(
+        STABLE_RULES,
+        start_speed=(0.5, 1.5),
+        start_acceleration=(-0.05, 0.05),
+        min_speed=0.1,
+        acceleration_chance=0.1,
+        acceleration_range=(-0.05, 0.05),
+        frame_time=0.1,
+        timeout=None,
+        single_winner=True,
+        bomb_chance=0.01,
+    ),
+}
+
+
+# Status of a tortoise in TortoiseTable.status
+RACING = 0
+FINISHED = 1
+EXPLODED = 2
+
+# Timed events of race["events"], in the order they happen within a frame
+TIMEOUT = 0  # Time is up for the tortoises still racing, the race ends with the frame before
+SPAWN = 1  # A bomb is placed on the tortoise
+COUNTDOWN = 2  # Its countdown goes down by one, it explodes at zero
+BOOM_END = 3  # The explosion is no longer shown
+
+BOOM_TICKS = 30  # Frames an explosion stays on screen
+
+
+class TortoiseTable:
+    """State of all the tortoises of a race, one typed array per field.
+
+    Tortoise i is x[i], speed[i], ... instead of a dict per tortoise: the arrays
+    hold raw numbers, about 30 bytes per tortoise, and the engine reads them
+    by index without any string lookup.
+    """
+
+    __slots__ = ("x", "speed", "acceleration", "place", "bomb", "status")
+
+    def __init__(self, num_tortoises):
+        self.x = array("d", bytes(8 * num_tortoises))
+        self.speed = array("d", bytes(8 * num_tortoises))
+        self.acceleration = array("d", bytes(8 * num_tortoises))
+        self.place = array("i", bytes(4 * num_tortoises))  # 1 for the winner, 0 while racing
+        self.bomb = array("b", [-1]) * num_tortoises  # Countdown of the bomb, -1 without one
+        self.status = array("b", bytes(num_tortoises))
+
+    def __len__(self):
+        return len(self.x)
+
+
+def geometric(rng, p):
+    """Number of failed trials before the first success, for trials of probability p."""
+    if p >= 1:
+        return 0
+    return int(math.log(1.0 - rng.random()) / math.log1p(-p))
+
+
+class Mode:
+    """A feature of the race, plugged into the engine through hooks.
+
+    A mode overrides the hooks it needs, and a race only calls the hooks its
+    modes override: a feature that is off has no hook in the tick loop at all.
+    Modes that need to act at a given frame queue a timed event in race["events"]
+    and list its kind in handles, they cost nothing until it is due.
+    """
+
+    handles = ()  # Kinds of the timed events passed to event()
+
+    def start(self, race):
+        """Once, when the race is created."""
+
+    def event(self, race, kind, i):
+        """When a timed event of a kind in handles is due, before the tortoises move."""
+
+    def place(self, race, crossed):
+        """Every frame some tortoises reach the line, their indices in the order they reached it."""
+
+    def over(self, race):
+        """Once, when the race is over."""
+
+
+HOOKS = ("place", "over")
+
+
+def _finish(race, i):
+    race["tortoises"].status[i] = FINISHED
+    race["finished"].append(i)
+    race["tortoises"].place[i] = len(race["finished"])
+
+
+class FullPlacing(Mode):
+    """Every tortoise that reaches the line gets a place, the race goes on until nobody is racing."""
+
+    def place(self, race, crossed):
+        for i in crossed:
+            _finish(race, i)
+
+
+class SingleWinner(Mode):
+    """The first tortoise to reach the line wins, the race stops there."""
+
+    def place(self, race, crossed):
+        _finish(race, crossed[0])
+        race["over"] = True
+
+
+class Timeout(Mode):
+    """Once the first tortoise finishes, the others have rules["timeout"] seconds left."""
+
+    handles = (TIMEOUT,)
+
+    def place(self, race, crossed):
+        if race["first_finish_tick"] is None:
+            heapq.heappush(race["events"], (race["tick"] + race["timeout_ticks"], TIMEOUT, -1))
+
+    def event(self, race, kind, i):
+        # Time is up: the tortoises still racing are ranked in lane order
+        for i in race["active"]:
+            _finish(race, i)
+        race["active"] = []
+        race["over"] = True
+
+
+class Bombs(Mode):
+    """Bombs placed on the tortoises at random, that blow them up at the end of a countdown.
+
+    Bombs are not rolled for every frame: the frame of the bomb of each tortoise
+    is drawn once, from the same geometric distribution, and queued as an event.
+    """
+
+    handles = (SPAWN, COUNTDOWN, BOOM_END)
+
+    def start(self, race):
+        chance = race["rules"]["bomb_chance"]
+        race["events"] += [(geometric(race["rng"], chance), SPAWN, i) for i in range(len(race["tortoises"]))]
+        heapq.heapify(race["events"])
+
+    def event(self, race, kind, i):
+        tortoises = race["tortoises"]
+        tick = race["tick"]
+        period = race["rules"]["bomb_period"]
+        if kind == BOOM_END:
+            race["booming"].discard(i)
+        elif tortoises.status[i] != RACING:
+            pass  # Finished before its bomb
+        elif kind == SPAWN:
+            tortoises.bomb[i] = race["rules"]["bomb_fuse"]
+            heapq.heappush(race["events"], (-(-tick // period) * period, COUNTDOWN, i))  # Next frame counting down
+        else:
+            tortoises.bomb[i] -= 1
+            if tortoises.bomb[i] > 0:
+                heapq.heappush(race["events"], (tick + period, COUNTDOWN, i))
+            else:
+                tortoises.status[i] = EXPLODED
+                race["exploded"].append(i)
+                race["booming"].add(i)
+                heapq.heappush(race["events"], (tick + BOOM_TICKS, BOOM_END, i))
+
+
+class Export(Mode):
+    """Save the results of the race to a results_store.ResultsStore once it is over.
+
+    The tortoises that finished come first in their order, then the exploded ones.
+    """
+
+    def __init__(self, store, names, variant=None, seed=None):
+        self.store = store
+        self.names = names
+        self.variant = variant
+        self.seed = seed
+        self.race_id = None
+
+    def over(self, race):
+        results = [(place, self.names[i], False) for place, i in enumerate(race["finished"], 1)]
+        results += [(len(results) + k, self.names[i], True) for k, i in enumerate(race["exploded"], 1)]
+        self.race_id = self.store.add_race(results, self.variant, self.seed)
+
+
+# The modes hold no state of their own, the races of the same rules share them
+_FULL_PLACING = FullPlacing()
+_SINGLE_WINNER = SingleWinner()
+_TIMEOUT = Timeout()
+_BOMBS = Bombs()
+
+
+def modes(rules):
+    """Modes of the features the rules turn on, every variant is one of their combinations."""
+    found = (_SINGLE_WINNER if rules["single_winner"] else _FULL_PLACING,)
+    if rules["timeout"] is not None:
+        found += (_TIMEOUT,)
+    if rules["bomb_chance"]:
+        found += (_BOMBS,)
+    return found
+
+
+def _hooks(race_modes):
+    """Hooks overridden by the modes, by name, and the event hooks by kind of event."""
+    hooks = {
+        name: tuple(getattr(mode, name) for mode in race_modes if getattr(type(mode), name) is not getattr(Mode, name))
+        for name in HOOKS
+    }
+    hooks["event"] = {kind: mode.event for mode in race_modes for kind in mode.handles}
+    return hooks
+
+
+_shared_hooks = functools.lru_cache(maxsize=None)(_hooks)  # Hooks of the modes of the rules alone
+
+
+def new_race(num_tortoises, finish_line, rules=STABLE_RULES, rng=random, extra_modes=()):
+    """Create the state of a race that has not started yet.
+
+    The race runs with the modes of its rules, then extra_modes, such as Export.
+    """
+    tortoises = TortoiseTable(num_tortoises)
+    for i in range(num_tortoises):
+        tortoises.speed[i] = rng.uniform(*rules["start_speed"])
+        tortoises.acceleration[i] = rng.uniform(*rules["start_acceleration"])
+    race_modes = modes(rules) + tuple(extra_modes)
+    race = {
+        "tortoises": tortoises,
+        "finish_line": finish_line,
+        "rules": rules,
+        "rng": rng,
+        "tick": 0,
+        "active": list(range(num_tortoises)),  # Indices of the tortoises still racing, in lane order
+        "finished": [],  # Indices of the tortoises in finishing order
+        "exploded": [],  # Indices of the tortoises blown up by a bomb
+        "booming": set(),  # Indices of the explosions still on screen
+        "events": [],  # Heap of the timed events, (tick, kind, index)
+        "first_finish_tick": None,
+        "timeout_ticks": None if rules["timeout"] is None else round(rules["timeout"] / rules["frame_time"]),
+        "over": False,
+        "modes": race_modes,
+        "hooks": _hooks(race_modes) if extra_modes else _shared_hooks(race_modes),
+    }
+    for mode in race_modes:
+        mode.start(race)
+    return race
+
+
+def end_race(race):
+    """Mark the race over and call the over hooks of its modes."""
+    race["over"] = True
+    for hook in race["hooks"]["over"]:
+        hook(race)
+
+
+def step(race):
+    """Advance the race by one frame and return the indices that finished in it.
+
+    Only the tortoises of the active set are visited, the ones that finished or
+    exploded leave it when it happens and cost nothing afterwards. Everything
+    else is up to the hooks of the modes of the race.
+    """
+    if race["over"]:
+        return []
+
+    hooks = race["hooks"]
+    events = race["events"]
+    finished = race["finished"]
+    placed = len(finished)
+    tick = race["tick"]
+
+    # Timed events cost nothing until the first one is due, the race can end on one
+    if events and events[0][0] <= tick:
+        handlers = hooks["event"]
+        while events and events[0][0] <= tick and not race["over"]:
+            _, kind, i = heapq.heappop(events)
+            handlers[kind](race, kind, i)
+        if race["over"]:
+            end_race(race)
+            return finished[placed:]
+        if len(finished) + len(race["exploded"]) + len(race["active"]) != len(race["tortoises"]):
+            status = race["tortoises"].status
+            race["active"] = [i for i in race["active"] if status[i] == RACING]
+
+    rules = race["rules"]
+    random_ = race["rng"].random
+    min_speed = rules["min_speed"]
+    chance = rules["acceleration_chance"]
+    low, high = rules["acceleration_range"]
+    spread = high - low
+    finish_line = race["finish_line"]
+    crossed = []  # (moment within the frame, index) of the tortoises reaching the line
+
+    tortoises = race["tortoises"]
+    x = tortoises.x
+    speed = tortoises.speed
+    acceleration = tortoises.acceleration
+
+    for i in race["active"]:
+        # Update speed with acceleration
+        s = speed[i] + acceleration[i]
+        if s < min_speed:
+            s = min_speed
+        speed[i] = s
+
+        # Randomly change acceleration
+        if random_() < chance:
+            acceleration[i] = low + spread * random_()
+
+        # Update position
+        x[i] += s
+
+        # Check if the tortoise has reached the finish line, and when within the frame
+        if x[i] >= finish_line:
+            crossed.append(((finish_line - x[i]) / s + 1, i))
+
+    # The finishes of the frame are ranked by the moment each tortoise reached the line,
+    # not by lane; lane order only breaks exact ties
+    if crossed:
+        crossed.sort()
+        crossed = [i for _, i in crossed]
+        for hook in hooks["place"]:
+            hook(race, crossed)
+        if race["first_finish_tick"] is None:
+            race["first_finish_tick"] = tick
+        status = tortoises.status
+        race["active"] = [i for i in race["active"] if status[i] == RACING]
+
+    race["tick"] = tick + 1
+
+    # A timeout due at the next frame ends the race with this one, every step of a race advances its tick
+    if events and events[0][1] == TIMEOUT and events[0][0] <= tick + 1 and not race["over"]:
+        heapq.heappop(events)
+        hooks["event"][TIMEOUT](race, TIMEOUT, -1)
+    if race["over"] or not race["active"]:
+        end_race(race)
+    return finished[placed:]
+
+
+def time_left(race):
+    """Seconds left before the timeout, or None if nobody has finished yet."""
+    if race["first_finish_tick"] is None or race["timeout_ticks"] is None:
+        return None
+    elapsed = (race["tick"] - race["first_finish_tick"]) * race["rules"]["frame_time"]
+    return max(0, race["rules"]["timeout"] - elapsed)
+
+
+def run(race, max_ticks=None):
+    """Run the race until it is over and return the finishing order."""
+    while not race["over"]:
+        if max_ticks is not None and race["tick"] >= max_ticks:
+            break
+        step(race)
+    return race["finished"]
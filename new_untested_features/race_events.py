@@ -0,0 +1,254 @@
+import bisect
+import math
+from array import array
+
+from race_engine import BOOM_END, BOOM_TICKS, COUNTDOWN, EXPLODED, FINISHED, RACING, SPAWN, end_race, geometric
+
+# Event-driven version of race_engine. Between two changes of acceleration the motion
+# of a tortoise has a closed form: its speed moves linearly until it is clamped at
+# min_speed, its position is the sum of the speeds. So a tortoise jumps from one change
+# to the next, then straight to the frame it crosses the line or its bomb goes off, and
+# a race costs O(events) instead of O(frames x tortoises). The tortoises only meet
+# through the end of the race, so each one runs on its own until it cannot change the
+# result any more.
+#
+# finish() runs a race of race_engine to its end from any frame, podium() only finds
+# its first places. Same rules and same distributions, but not the same random numbers.
+# The frames are exact, only the positions can differ from the frame by frame sums by rounding.
+
+NEVER = 2**62  # Frames to the next change of acceleration when there is no chance of one
+
+
+def _distance(v, a, min_speed, frames):
+    """Distance covered in the next frames with acceleration a, from speed v >= min_speed."""
+    if a < 0:
+        free = min(frames, int((v - min_speed) / -a))  # Frames before the speed is clamped
+        return free * v + a * free * (free + 1) / 2 + (frames - free) * min_speed
+    return frames * v + a * frames * (frames + 1) / 2
+
+
+def _crossing(distance, v, a, min_speed, frames):
+    """First of the next frames at the end of which distance is covered, or None."""
+    if frames <= 0 or _distance(v, a, min_speed, frames) < distance:
+        return None
+    low, high = 1, frames  # The distance never decreases, so a binary search finds it
+    while low < high:
+        middle = (low + high) // 2
+        if _distance(v, a, min_speed, middle) >= distance:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def _bombs(race):
+    """(first countdown frame, countdown before it, spawn frame) of the bombs of the tortoises still racing."""
+    rules = race["rules"]
+    period = rules["bomb_period"]
+    bombs = {}
+    for tick, kind, i in race["events"]:
+        if race["tortoises"].status[i] != RACING:
+            continue
+        if kind == SPAWN:
+            bombs[i] = (-(-tick // period) * period, rules["bomb_fuse"], tick)
+        elif kind == COUNTDOWN:
+            bombs[i] = (tick, race["tortoises"].bomb[i], tick)
+    return bombs
+
+
+def _run(race, keep, record):
+    """Run every tortoise of the race on its own, until the first keep places are decided (all with None).
+
+    A tortoise goes from one change of acceleration to the next until it crosses the
+    line, its bomb goes off, or it can no longer matter: once keep tortoises have
+    finished it has to beat the last of them, and once somebody has finished the race
+    ends at the timeout. With record, the stretches of every tortoise are kept, to
+    find where it stood at any frame afterwards.
+
+    Returns the crossings (index: frame, moment within it, position and speed at the line), the
+    explosions (index: frame), the stretches (index: first frames, and position,
+    speed and acceleration before each) and the frame of the first finish.
+    """
+    rules = race["rules"]
+    rng = race["rng"]
+    random_ = rng.random
+    tortoises = race["tortoises"]
+    finish_line = race["finish_line"]
+    min_speed = rules["min_speed"]
+    low, high = rules["acceleration_range"]
+    spread = high - low
+    chance = rules["acceleration_chance"]
+    log_stay = math.log1p(-chance) if chance < 1 else -math.inf  # Log of the chance to keep the acceleration
+    timeout_ticks = race["timeout_ticks"]
+    tick = race["tick"]
+
+    # Frame each bomb goes off: the fuse counts down every period from the first countdown
+    period = rules["bomb_period"]
+    explodes = {i: first + (fuse - 1) * period for i, (first, fuse, _) in _bombs(race).items()}
+
+    first_finish = race["first_finish_tick"]
+    timeout = math.inf if first_finish is None or timeout_ticks is None else first_finish + timeout_ticks - 1
+    leaders = []  # (frame, moment) of the first keep crossings so far
+    limit = timeout
+    crossings = {}
+    booms = {}
+    stretches = {}
+    for i in race["active"]:
+        x, v, a = tortoises.x[i], tortoises.speed[i], tortoises.acceleration[i]
+        last = tick - 1
+        change = tick + (geometric(rng, chance) if chance else NEVER)
+        boom = explodes.get(i, math.inf)
+        stop = min(limit, boom - 1)
+        if record:
+            starts = array("q")
+            states = array("d")
+            stretches[i] = (starts, states)
+        while True:
+            if record:
+                starts.append(last)
+                states.extend((x, v, a))
+            end = change if change < stop else stop
+            frames = end - last
+
+            # Distance and speed at the end of the stretch, _distance() inlined as it runs for every stretch
+            if a < 0 and (v - min_speed) < -a * frames:
+                free = int((v - min_speed) / -a)
+                distance = free * v + a * free * (free + 1) / 2 + (frames - free) * min_speed
+                speed = min_speed
+            else:
+                distance = frames * v + a * frames * (frames + 1) / 2
+                speed = v + frames * a
+            if x + distance >= finish_line:
+                frames = _crossing(finish_line - x, v, a, min_speed, frames)
+                x += _distance(v, a, min_speed, frames)
+                v = max(v + frames * a, min_speed)
+                crossings[i] = (last + frames, (finish_line - x) / v + 1, x, v)
+                break
+            if end == stop:
+                if boom - 1 == stop:
+                    booms[i] = boom
+                break
+            x += distance
+            v = speed
+            last = end
+            a = low + spread * random_()
+            change = end + 1 + int(math.log(1.0 - random_()) / log_stay)
+
+        if i in crossings:
+            frame, moment, _, _ = crossings[i]
+            if timeout_ticks is not None and (first_finish is None or frame < first_finish):
+                first_finish = frame
+                timeout = frame + timeout_ticks - 1
+            if keep is not None:
+                bisect.insort(leaders, (frame, moment))
+                del leaders[keep:]
+            # The next lanes must finish by the frame of the last of the leaders, and earlier within it
+            limit = min(timeout, leaders[-1][0]) if keep is not None and len(leaders) == keep else timeout
+    return crossings, booms, stretches, first_finish
+
+
+def _results(race, crossings, booms, first_finish):
+    """Finishing order, explosions, and last frame of the race, from the events of _run()."""
+    rules = race["rules"]
+    end = math.inf
+    if first_finish is not None and race["timeout_ticks"] is not None:
+        end = first_finish + race["timeout_ticks"] - 1
+    # Finishes of the same frame are ranked by the moment each tortoise reached the line
+    order = sorted((frame, moment, i) for i, (frame, moment, _, _) in crossings.items() if frame <= end)
+    if rules["single_winner"] and order:
+        order = order[:1]
+        end = order[0][0]
+    order = [(frame, i) for frame, _, i in order]
+    blown = sorted((frame, i) for i, frame in booms.items() if frame <= end)
+    done = {i for _, i in order + blown}
+    waiting = [i for i in race["active"] if i not in done]
+    if not waiting:
+        end = max(frame for frame, _ in order + blown)
+    return order, blown, waiting, end
+
+
+def podium(race, places):
+    """Indices of the first places of a race of race_engine, from the frame it is at.
+
+    Only what decides them is run, and the race itself is not changed: the fast
+    path for the odds, where millions of races are only looked at for their podium.
+    """
+    if race["over"]:
+        return race["finished"][:places]
+    keep = 1 if race["rules"]["single_winner"] else places
+    crossings, booms, _, first_finish = _run(race, keep, False)
+    order, _, waiting, _ = _results(race, crossings, booms, first_finish)
+    first = race["finished"] + [i for _, i in order]
+    if not race["rules"]["single_winner"] and first_finish is not None and race["timeout_ticks"] is not None:
+        first += waiting  # Time is up for them, ranked in lane order
+    return first[:places]
+
+
+def finish(race):
+    """Run a race of race_engine to its end, from the frame it is at, and return the finishing order.
+
+    The race is left as race_engine.step() would leave it at the end: places,
+    positions, explosions, tick and "over".
+    """
+    if race["over"]:
+        return race["finished"]
+
+    rules = race["rules"]
+    tortoises = race["tortoises"]
+    status = tortoises.status
+    min_speed = rules["min_speed"]
+    period = rules["bomb_period"]
+    bombs = _bombs(race)
+    crossings, booms, stretches, first_finish = _run(race, 1 if rules["single_winner"] else None, True)
+    order, blown, waiting, end = _results(race, crossings, booms, first_finish)
+
+    finished = race["finished"]
+    for frame, i in order:
+        _, _, tortoises.x[i], tortoises.speed[i] = crossings[i]
+        tortoises.acceleration[i] = stretches[i][1][-1]
+        status[i] = FINISHED
+        finished.append(i)
+        tortoises.place[i] = len(finished)
+        if race["first_finish_tick"] is None:
+            race["first_finish_tick"] = frame
+    for frame, i in blown:
+        _place(tortoises, i, stretches[i], frame - 1, min_speed)
+        status[i] = EXPLODED
+        race["exploded"].append(i)
+
+    # The others stopped at the end of the race
+    for i in waiting:
+        _place(tortoises, i, stretches[i], end, min_speed)
+    if waiting and not rules["single_winner"]:
+        # Time is up: the tortoises still racing are ranked in lane order
+        for i in waiting:
+            status[i] = FINISHED
+            finished.append(i)
+            tortoises.place[i] = len(finished)
+
+    # Countdowns of the bombs when the race ended, or when their tortoise finished
+    stops = {i: frame for frame, i in order}
+    for i, (first, fuse, spawn) in bombs.items():
+        stop = stops.get(i, end)
+        if status[i] == EXPLODED:
+            tortoises.bomb[i] = 0
+        elif spawn <= stop:
+            tortoises.bomb[i] = fuse - max(0, (stop - first) // period + 1)
+    race["booming"] = {i for frame, kind, i in race["events"] if kind == BOOM_END and frame > end}
+    race["booming"].update(i for frame, i in blown if frame + BOOM_TICKS > end)
+    race["events"] = []
+    race["active"] = [i for i in race["active"] if status[i] == RACING]
+    race["tick"] = end + 1
+    end_race(race)
+    return finished
+
+
+def _place(tortoises, i, stretch, frame, min_speed):
+    # Put tortoise i where it stood at the end of frame, from the stretch it was in then
+    starts, states = stretch
+    k = bisect.bisect_right(starts, frame) - 1
+    x, v, a = states[3 * k:3 * k + 3]
+    frames = frame - starts[k]
+    tortoises.x[i] = x + _distance(v, a, min_speed, frames)
+    tortoises.speed[i] = max(v + frames * a, min_speed) if frames else v
+    tortoises.acceleration[i] = a
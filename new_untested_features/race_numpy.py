@@ -0,0 +1,274 @@
+import numpy as np
+
+from race_engine import STABLE_RULES
+
+# Vectorized version of race_engine: every field is an array of shape (races, tortoises),
+# so a single step() advances all the tortoises of thousands of independent races at once.
+# A single race is simply num_races=1.
+#
+# A step can also cover several frames (time_step), for simulations that need fewer of
+# them: the motion between two changes of acceleration has the same closed form as in
+# race_events, so a step only splits at the changes due within it and its end is exact.
+# The bombs due within a step are handled at its start. The finishes of a step are ranked
+# by the moment each tortoise reached the line within it, so the placings stay fair
+# however long the steps are.
+
+NEVER = np.iinfo(np.int64).max  # Frame of the next change of acceleration when there is no chance of one
+
+
+def new_races(num_races, num_tortoises, finish_line, rules=STABLE_RULES, seed=None, time_step=1):
+    """Create the state of num_races races that have not started yet, stepping time_step frames at a time."""
+    rng = np.random.default_rng(seed)
+    shape = (num_races, num_tortoises)
+    races = {
+        "x": np.zeros(shape),
+        "speed": rng.uniform(*rules["start_speed"], shape),
+        "acceleration": rng.uniform(*rules["start_acceleration"], shape),
+        "finished": np.zeros(shape, dtype=bool),
+        "place": np.zeros(shape, dtype=np.int32),  # 1 for the winner, 0 while racing
+        "bomb": np.full(shape, -1, dtype=np.int16),  # Countdown of the bombs, -1 without one
+        "exploded": np.zeros(shape, dtype=bool),
+        "num_finished": np.zeros(num_races, dtype=np.int32),
+        "num_exploded": np.zeros(num_races, dtype=np.int32),
+        "first_finish_tick": np.full(num_races, -1),
+        "start_tick": np.zeros(num_races, dtype=np.int64),
+        "over": np.zeros(num_races, dtype=bool),
+        "finish_line": finish_line,
+        "rules": rules,
+        "rng": rng,
+        "tick": 0,  # Frames since the start, time_step more after every step
+        "time_step": time_step,
+        "timeout_ticks": None if rules["timeout"] is None else round(rules["timeout"] / rules["frame_time"]),
+    }
+    # Frames of the next change of acceleration and of the bomb of every tortoise,
+    # counted from the start of its race: geometric gaps instead of a draw per frame
+    races["next_change"] = _first_tick(rng, rules["acceleration_chance"], shape)
+    if rules["bomb_chance"]:
+        races["spawn_tick"] = _first_tick(rng, rules["bomb_chance"], shape)
+    return races
+
+
+def _first_tick(rng, chance, shape):
+    if not chance:
+        return np.full(shape, NEVER, dtype=np.int64)
+    return rng.geometric(chance, shape) - 1
+
+
+def _rank(races, mask, moment=None):
+    """Give the next places to the tortoises in mask, by moment within each race, in lane order without."""
+    places = races["num_finished"][:, None] + np.cumsum(mask, axis=1)
+    if moment is not None:
+        # Only the races with several finishes at once need sorting, lane order breaks exact ties
+        rows = np.flatnonzero(mask.sum(axis=1) > 1)
+        if len(rows):
+            key = np.where(mask[rows], moment[rows], np.inf)
+            order = np.argsort(key, axis=1, kind="stable")
+            ranks = np.empty_like(order)
+            np.put_along_axis(ranks, order, np.arange(mask.shape[1]), axis=1)
+            places[rows] = races["num_finished"][rows, None] + ranks + 1
+    np.copyto(races["place"], places, where=mask)
+    races["num_finished"] += mask.sum(axis=1, dtype=np.int32)
+    races["finished"] |= mask
+
+
+def step(races):
+    """Advance every race that is not over by one step, time_step frames."""
+    rules = races["rules"]
+    rng = races["rng"]
+    x = races["x"]
+    speed = races["speed"]
+    acceleration = races["acceleration"]
+    frames = races["time_step"]
+    min_speed = rules["min_speed"]
+    active = ~races["finished"]
+    active &= ~races["exploded"]
+    active &= ~races["over"][:, None]
+    race_tick = races["tick"] - races["start_tick"]  # The frames of every race are counted from its start
+    step_end = race_tick[:, None] + frames  # First frame after the step
+    late = None
+    timeout_ticks = races["timeout_ticks"]
+    if timeout_ticks is not None and frames > 1:
+        # A step stops at the timeout of its race, the tortoises still racing then are ranked in lane order
+        first = races["first_finish_tick"]
+        timeout = np.where((first >= 0) & ~races["over"], first - races["start_tick"] + timeout_ticks, NEVER)
+        step_end = np.minimum(step_end, timeout[:, None])
+
+    if rules["bomb_chance"]:
+        # Place the bombs due in this step
+        bomb = races["bomb"]
+        spawn_tick = races["spawn_tick"]
+        period = rules["bomb_period"]
+        if frames == 1:
+            spawn = spawn_tick == race_tick[:, None]
+            spawn &= active
+            bomb[spawn] = rules["bomb_fuse"]
+
+            # Handle bomb countdown
+            countdown = race_tick % period == 0
+            if countdown.any():
+                np.subtract(bomb, 1, out=bomb, where=active & (bomb > 0) & countdown[:, None])
+        else:
+            spawn = spawn_tick < step_end
+            spawn &= spawn_tick >= race_tick[:, None]
+            spawn &= active
+            bomb[spawn] = rules["bomb_fuse"]
+
+            # Handle bomb countdown, every frame of the step that is a multiple of the period counts
+            first = -(-np.where(spawn, spawn_tick, race_tick[:, None]) // period)  # First countdown, in periods
+            countdowns = -(-step_end // period) - first
+            counting = countdowns > 0
+            counting &= active
+            counting &= bomb > 0
+            if counting.any():
+                boom = (first + bomb - 1) * period  # Frame the bomb goes off
+                np.maximum(bomb - countdowns, 0, out=bomb, where=counting, casting="unsafe")
+
+                # The bombs going off later in the step let their tortoise run until then
+                late = bomb == 0
+                late &= counting
+                late &= boom > race_tick[:, None]
+                if late.any():
+                    step_end = np.where(late, boom, step_end)
+                else:
+                    late = None
+        explode = bomb == 0
+        explode &= active
+        if late is not None:
+            explode &= ~late
+        if explode.any():
+            races["exploded"] |= explode
+            races["num_exploded"] += explode.sum(axis=1, dtype=np.int32)
+            active &= ~explode
+
+    # Update speed with acceleration, and the distance covered in the step
+    next_change = races["next_change"]
+    change = next_change < step_end
+    change &= active
+    due = np.flatnonzero(change)  # Indices into the flattened arrays, cheaper than two boolean masks
+    if frames == 1:
+        np.maximum(speed + acceleration, min_speed, out=speed, where=active)
+        distance = speed
+
+        # Randomly change acceleration, only the tortoises whose change is due draw numbers
+        if len(due):
+            acceleration.ravel()[due] = rng.uniform(*rules["acceleration_range"], len(due))
+            next_change.ravel()[due] += rng.geometric(rules["acceleration_chance"], len(due))
+    else:
+        # The step is split at the changes of acceleration due within it, the motion
+        # is exact at its end whatever its length
+        distance = np.zeros(x.shape)
+        start = np.repeat(race_tick, x.shape[1])  # First frame not covered yet, of every cell
+        end = np.broadcast_to(step_end, x.shape).ravel()
+        cells = due
+        while len(cells):
+            covered = next_change.ravel()[cells] + 1 - start[cells]
+            v, a = speed.ravel()[cells], acceleration.ravel()[cells]
+            distance.ravel()[cells] += _distance(v, a, min_speed, covered)
+            speed.ravel()[cells] = np.maximum(v + covered * a, min_speed)
+            acceleration.ravel()[cells] = rng.uniform(*rules["acceleration_range"], len(cells))
+            start[cells] = next_change.ravel()[cells] + 1
+            next_change.ravel()[cells] += rng.geometric(rules["acceleration_chance"], len(cells))
+            cells = cells[next_change.ravel()[cells] < end[cells]]
+        left = step_end - start.reshape(x.shape)
+        distance += _distance(speed, acceleration, min_speed, left)
+        np.maximum(speed + left * acceleration, min_speed, out=speed, where=active)
+
+    # Update position
+    np.add(x, distance, out=x, where=active)
+
+    # Check which tortoises reached the finish line, and when within the step
+    crossed = x >= races["finish_line"]
+    crossed &= active
+    if late is not None:
+        late &= ~crossed  # The ones that did not make it before their bomb
+    if crossed.any():
+        # Frames into the step it took to reach the line, the motion being taken as linear within it
+        moment = np.full(x.shape, np.inf)
+        np.divide(races["finish_line"] - x, distance, out=moment, where=crossed)
+        moment += 1
+        if frames > 1:
+            moment *= step_end - race_tick[:, None]
+        if rules["single_winner"]:
+            # Only the first one to reach the line wins, as the race stops right there
+            rows = np.flatnonzero(crossed.any(axis=1))
+            cols = moment[rows].argmin(axis=1)
+            crossed[:] = False
+            crossed[rows, cols] = True
+            if late is not None:
+                # The race is over once the winner crossed, the bombs of the step after that never go off
+                late[rows] &= boom[rows] < race_tick[rows, None] + np.ceil(moment[rows, cols])[:, None]
+        # Frame of the first finish, within the step
+        first = races["first_finish_tick"]
+        new = (first < 0) & crossed.any(axis=1)
+        first[new] = races["tick"] + np.ceil(moment[new].min(axis=1)) - 1
+        if timeout_ticks is not None and frames > 1 and new.any():
+            # The first finish of the step starts the timeout, the ones after it within the step are too late
+            crossed[new] &= races["tick"] + np.ceil(moment[new]) - 1 - first[new, None] < timeout_ticks
+            if late is not None:
+                late[new] &= races["start_tick"][new, None] + boom[new] - first[new, None] < timeout_ticks
+        _rank(races, crossed, moment)
+    if late is not None:
+        races["exploded"] |= late
+        races["num_exploded"] += late.sum(axis=1, dtype=np.int32)
+
+    races["tick"] += frames
+
+    over = races["over"]
+    over |= races["num_finished"] + races["num_exploded"] == x.shape[1]
+    if rules["single_winner"]:
+        over |= races["num_finished"] > 0
+
+    # Time is up: the tortoises still racing are ranked in lane order
+    if races["timeout_ticks"] is not None:
+        first = races["first_finish_tick"]
+        timed_out = (first >= 0) & (races["tick"] - first >= races["timeout_ticks"]) & ~over
+        if timed_out.any():
+            _rank(races, ~races["finished"] & ~races["exploded"] & timed_out[:, None])
+            over |= timed_out
+
+
+def _distance(v, a, min_speed, frames):
+    """Distance covered in the next frames with acceleration a, from speed v >= min_speed, as in race_events."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        free = np.where(a < 0, np.floor((v - min_speed) / -a), frames)
+    np.clip(free, 0, frames, out=free)
+    return free * v + a * free * (free + 1) / 2 + (frames - free) * min_speed
+
+
+def restart(races, mask):
+    """Replace the races in mask with new ones starting at the current tick."""
+    rules = races["rules"]
+    rng = races["rng"]
+    shape = (np.count_nonzero(mask), races["x"].shape[1])
+    races["x"][mask] = 0
+    races["speed"][mask] = rng.uniform(*rules["start_speed"], shape)
+    races["acceleration"][mask] = rng.uniform(*rules["start_acceleration"], shape)
+    races["finished"][mask] = False
+    races["place"][mask] = 0
+    races["bomb"][mask] = -1
+    races["exploded"][mask] = False
+    races["num_finished"][mask] = 0
+    races["num_exploded"][mask] = 0
+    races["first_finish_tick"][mask] = -1
+    races["start_tick"][mask] = races["tick"]
+    races["over"][mask] = False
+    races["next_change"][mask] = _first_tick(rng, rules["acceleration_chance"], shape)
+    if rules["bomb_chance"]:
+        races["spawn_tick"][mask] = _first_tick(rng, rules["bomb_chance"], shape)
+
+
+def run(races, max_ticks=None):
+    """Run every race until it is over and return the places, shape (races, tortoises)."""
+    while not races["over"].all():
+        if max_ticks is not None and races["tick"] >= max_ticks:
+            break
+        step(races)
+    return races["place"]
+
+
+def finishing_order(races):
+    """Indices of the tortoises of each race in finishing order, once the races are over.
+
+    Tortoises without a place (exploded, or beaten in a single winner race) come first.
+    """
+    return np.argsort(races["place"], axis=1, kind="stable")
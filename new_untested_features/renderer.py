@@ -0,0 +1,167 @@
+import curses
+import unicodedata
+
+BLANK = (" ", 0)
+WIDE = ""  # Second cell of a character that takes two columns, like the tortoise
+MERGE_GAP = 3  # Unchanged cells between two changes that are cheaper to resend than to skip
+MOVE_COST = 6  # Bytes of a cursor movement escape sequence, roughly
+
+
+def cells(text):
+    """Split text into terminal cells, wide characters take two of them."""
+    result = []
+    for ch in text:
+        result.append(ch)
+        if unicodedata.east_asian_width(ch) in "WF":
+            result.append(WIDE)
+    return result
+
+
+class DiffRenderer:
+    """Draw frames on a curses window sending only the cells that changed since the previous frame.
+
+    Every frame starts blank: draw it with addstr() like on the window, then call
+    present(). The renderer compares it with the frame on screen and rewrites only
+    the runs of cells that differ.
+
+    What does not change from frame to frame can go to the static layer with
+    addstr_static() instead: it stays under every frame until clear_static(), and
+    the rows that only hold static content are not even compared.
+    """
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.height, self.width = stdscr.getmaxyx()
+        self._blank_row = [BLANK] * self.width
+        self._front = {}  # Rows on screen, missing rows are blank
+        self._back = {}  # Rows of the frame being drawn
+        self._static = {}  # Rows of the static layer
+        self._static_dirty = set()  # Static rows changed since the last present()
+        self._drawn = set()  # Rows drawn with addstr() in the frame on screen
+        self.cells_written = 0  # Cells sent by the last present()
+        self.bytes_written = 0  # Approximate bytes sent to the terminal by the last present()
+
+    def addstr(self, y, x, text, attr=0):
+        """Draw text at (y, x) in the next frame, clipping what falls off the window."""
+        if not 0 <= y < self.height:
+            return
+        row = self._back.get(y)
+        if row is None:
+            row = self._back[y] = list(self._static.get(y, self._blank_row))
+        self._write(row, x, text, attr)
+
+    def addstr_static(self, y, x, text, attr=0):
+        """Draw text at (y, x) in the static layer, under this frame and the next ones."""
+        if not 0 <= y < self.height:
+            return
+        row = self._static.get(y)
+        if row is None:
+            row = self._static[y] = list(self._blank_row)
+        self._write(row, x, text, attr)
+        self._static_dirty.add(y)
+
+    def clear_static(self, y=None):
+        """Erase row y of the static layer, or all of it."""
+        rows = list(self._static) if y is None else [y]
+        for y in rows:
+            if self._static.pop(y, None) is not None:
+                self._static_dirty.add(y)
+
+    def _write(self, row, x, text, attr):
+        start = x
+        for ch in cells(text):
+            if 0 <= x < self.width:
+                row[x] = (ch, attr)
+            x += 1
+
+        # Do not leave half of a wide character on either side of the text, or cut by the edge of the window
+        if 0 < start < self.width and row[start][0] == WIDE:
+            row[start - 1] = BLANK
+        if 0 <= x < self.width and row[x][0] == WIDE:
+            row[x] = BLANK
+        if start < self.width < x and row[-1][0] != WIDE and unicodedata.east_asian_width(row[-1][0]) in "WF":
+            row[-1] = BLANK  # curses would wrap it to the next row
+
+    def invalidate(self):
+        """Forget what is on screen, the window has been cleared behind our back."""
+        self._front = {}
+        self._static_dirty.update(self._static)
+
+    def resize(self, height, width):
+        """The window changed size and was cleared: the next frame is drawn whole.
+
+        The static rows still on screen are kept if the width did not change.
+        """
+        if width != self.width:
+            self._static = {}
+        else:
+            self._static = {y: row for y, row in self._static.items() if y < height}
+        self.height, self.width = height, width
+        self._blank_row = [BLANK] * width
+        self._back = {}
+        self._drawn = set()
+        self.invalidate()
+
+    def present(self):
+        """Send the changes of the frame to the terminal and show it."""
+        self.cells_written = 0
+        self.bytes_written = 0
+
+        # Rows drawn in this frame or the previous one, and static rows that changed
+        front = self._front
+        for y in self._back.keys() | self._drawn | self._static_dirty:
+            new = self._back.get(y) or self._static.get(y, self._blank_row)
+            old = front.get(y, self._blank_row)
+            if new != old:
+                self._draw_changes(y, old, new)
+            front[y] = new
+        self._drawn = set(self._back)
+        self._static_dirty = set()
+        self._back = {}
+        self.stdscr.refresh()
+
+    def _draw_changes(self, y, old, new):
+        width = self.width
+        x = 0
+        while x < width:
+            if new[x] == old[x]:
+                x += 1
+                continue
+
+            # Collect a run of changed cells, swallowing short unchanged gaps
+            start = x
+            end = x + 1
+            gap = 0
+            x += 1
+            while x < width and gap <= MERGE_GAP:
+                if new[x] != old[x]:
+                    end = x + 1
+                    gap = 0
+                else:
+                    gap += 1
+                x += 1
+
+            # A wide character must be sent whole
+            if new[start][0] == WIDE and start > 0:
+                start -= 1
+            while end < width and new[end][0] == WIDE:
+                end += 1
+            self._draw_run(y, start, new[start:end])
+            x = max(x, end)
+
+    def _draw_run(self, y, x, run):
+        # One addstr per stretch of cells sharing the same attributes
+        i = 0
+        while i < len(run):
+            attr = run[i][1]
+            j = i
+            while j < len(run) and run[j][1] == attr:
+                j += 1
+            text = "".join(ch for ch, _ in run[i:j])
+            try:
+                self.stdscr.addstr(y, x + i, text, attr)
+            except curses.error:
+                pass  # Writing the bottom right cell moves the cursor off the window
+            self.cells_written += j - i
+            self.bytes_written += len(text.encode()) + MOVE_COST
+            i = j
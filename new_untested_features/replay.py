@@ -0,0 +1,254 @@
+import heapq
+import json
+import struct
+
+from race_engine import BOOM_TICKS, EXPLODED, RACING, TortoiseTable
+
+# Binary replay of a race: a header with the seed, the rules and the names, then one
+# record per tick. Every KEYFRAME_INTERVAL ticks the record is a keyframe with the full
+# state, in between it is a delta with only the tortoises that moved or changed status.
+# An index of the keyframes at the end of the file lets the player seek to any tick by
+# reading one keyframe and at most KEYFRAME_INTERVAL - 1 deltas.
+#
+#   header    MAGIC, version u8, seed u64, tortoises u16, finish line f64, keyframe interval u16,
+#             JSON length u32 + JSON {"rules": ..., "names": ...}
+#   keyframe  b"K", tick u32, first finish tick i32, tortoises * (x f32, place u16, bomb i8, status u8)
+#   delta     b"D", moved u16, moved * (index u16, x f32), changed u16, changed * (index u16, place u16, bomb i8, status u8)
+#   index     b"I", ticks u32, keyframes u32, keyframes * offset u64
+#   trailer   index offset u64, END
+
+MAGIC = b"TRRP"
+END = b"TREN"
+VERSION = 1
+KEYFRAME_INTERVAL = 64
+MAX_TORTOISES = 2**16 - 1  # Indices and places are stored as u16
+
+HEADER = struct.Struct("<4sBQHdH")
+JSON_LENGTH = struct.Struct("<I")
+KEYFRAME = struct.Struct("<cIi")
+COUNT = struct.Struct("<H")
+MOVED = struct.Struct("<Hf")
+CHANGED = struct.Struct("<HHbB")
+STATUS = struct.Struct("<fHbB")
+INDEX = struct.Struct("<cII")
+OFFSET = struct.Struct("<Q")
+TRAILER = struct.Struct("<Q4s")
+
+
+def _f32(x):
+    """x rounded to the precision it is stored with."""
+    return struct.unpack("<f", struct.pack("<f", x))[0]
+
+
+def _status(tortoises, i):
+    """Place, bomb countdown and status of a tortoise as stored in the file."""
+    return tortoises.place[i], tortoises.bomb[i], tortoises.status[i]
+
+
+def header(race, seed, names, keyframe_interval=KEYFRAME_INTERVAL):
+    """Header of a replay of the race, with everything needed to draw it."""
+    if len(race["tortoises"]) > MAX_TORTOISES:
+        raise ValueError(f"A replay holds {MAX_TORTOISES} tortoises at most.")
+    meta = json.dumps({"rules": race["rules"], "names": names}).encode()
+    return (HEADER.pack(MAGIC, VERSION, seed, len(race["tortoises"]), race["finish_line"], keyframe_interval)
+            + JSON_LENGTH.pack(len(meta)) + meta)
+
+
+def read_header(data, name="The data"):
+    """(seed, tortoises, finish line, keyframe interval, rules, names, offset after the header) of a header."""
+    magic, version, seed, num_tortoises, finish_line, keyframe_interval = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{name} is not a Tortoise Rush replay.")
+    (length,) = JSON_LENGTH.unpack_from(data, HEADER.size)
+    start = HEADER.size + JSON_LENGTH.size
+    meta = json.loads(data[start:start + length])
+    return seed, num_tortoises, finish_line, keyframe_interval, meta["rules"], meta["names"], start + length
+
+
+class RaceEncoder:
+    """Keyframe and delta records of the successive states of a race."""
+
+    def __init__(self, num_tortoises):
+        self._x = [None] * num_tortoises
+        self._status = [None] * num_tortoises
+
+    def keyframe(self, race):
+        """Record of the full state of the race."""
+        tortoises = race["tortoises"]
+        first = race["first_finish_tick"]
+        parts = [KEYFRAME.pack(b"K", race["tick"], -1 if first is None else first)]
+        for i in range(len(tortoises)):
+            self._x[i] = _f32(tortoises.x[i])
+            self._status[i] = _status(tortoises, i)
+            parts.append(STATUS.pack(self._x[i], *self._status[i]))
+        return b"".join(parts)
+
+    def delta(self, race):
+        """Record of what changed since the previous record, one tick earlier."""
+        tortoises = race["tortoises"]
+        moved = []
+        changed = []
+        for i in range(len(tortoises)):
+            x = _f32(tortoises.x[i])
+            if x != self._x[i]:
+                self._x[i] = x
+                moved.append(MOVED.pack(i, x))
+            status = _status(tortoises, i)
+            if status != self._status[i]:
+                self._status[i] = status
+                changed.append(CHANGED.pack(i, *status))
+        return b"D" + COUNT.pack(len(moved)) + b"".join(moved) + COUNT.pack(len(changed)) + b"".join(changed)
+
+
+class RaceDecoder:
+    """Rebuild the state of a race from the records of RaceEncoder.
+
+    The state mimics the race of race_engine, so the same code draws live races,
+    replays and streamed races.
+    """
+
+    def __init__(self, num_tortoises, finish_line, rules):
+        self.num_tortoises = num_tortoises
+        self.finish_line = finish_line
+        self.rules = rules
+        self.num_ticks = None  # Last tick, when known
+        self.race = None
+        self._booms = []  # Heap of (tick, index) of the explosions on screen, by end tick
+
+    def read_keyframe(self, data, offset):
+        """Apply the keyframe at offset in data and return the offset after it."""
+        _, tick, first = KEYFRAME.unpack_from(data, offset)
+        offset += KEYFRAME.size
+
+        # The state is updated in place, so that whoever holds it sees the new tick
+        if self.race is None:
+            self.race = {
+                "tortoises": TortoiseTable(self.num_tortoises),  # Speeds are not recorded, they stay at 0
+                "finish_line": self.finish_line,
+                "rules": self.rules,
+                "timeout_ticks": None if self.rules["timeout"] is None else round(self.rules["timeout"] / self.rules["frame_time"]),
+            }
+        tortoises = self.race["tortoises"]
+        for i in range(self.num_tortoises):
+            tortoises.x[i], tortoises.place[i], tortoises.bomb[i], tortoises.status[i] = STATUS.unpack_from(data, offset)
+            offset += STATUS.size
+        self.race["tick"] = tick
+        self.race["first_finish_tick"] = None if first < 0 else first
+        self.race["over"] = self.num_ticks is not None and tick >= self.num_ticks
+        self._update_order()
+        self._update_booms()
+        return offset
+
+    def read_delta(self, data, offset):
+        """Apply the delta at offset in data and return the offset after it."""
+        race = self.race
+        tortoises = race["tortoises"]
+        offset += 1  # Record type
+        (moved,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        for _ in range(moved):
+            i, x = MOVED.unpack_from(data, offset)
+            offset += MOVED.size
+            tortoises.x[i] = x
+        (changed,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        for _ in range(changed):
+            i, tortoises.place[i], tortoises.bomb[i], tortoises.status[i] = CHANGED.unpack_from(data, offset)
+            offset += CHANGED.size
+            if tortoises.status[i] == EXPLODED:
+                heapq.heappush(self._booms, (race["tick"] + BOOM_TICKS, i))
+        race["tick"] += 1
+        if changed:
+            self._update_order()
+            if race["finished"] and race["first_finish_tick"] is None:
+                race["first_finish_tick"] = race["tick"] - 1
+        race["over"] = self.num_ticks is not None and race["tick"] >= self.num_ticks
+        self._update_booms()
+        return offset
+
+    def _update_booms(self):
+        # Explosions still on screen, as kept by the engine
+        booms = self._booms
+        while booms and booms[0][0] < self.race["tick"]:
+            heapq.heappop(booms)
+        self.race["booming"] = {i for _, i in booms}
+
+    def _update_order(self):
+        # Finishing order, exploded and still racing tortoises, as kept by the engine
+        tortoises = self.race["tortoises"]
+        placed = [i for i in range(self.num_tortoises) if tortoises.place[i]]
+        self.race["finished"] = sorted(placed, key=tortoises.place.__getitem__)
+        self.race["exploded"] = [i for i in range(self.num_tortoises) if tortoises.status[i] == EXPLODED]
+        self.race["active"] = [i for i in range(self.num_tortoises) if tortoises.status[i] == RACING]
+
+
+class ReplayRecorder:
+    """Write a race to a replay file, call record() after every step of the engine."""
+
+    def __init__(self, path, race, seed, names, keyframe_interval=KEYFRAME_INTERVAL):
+        data = header(race, seed, names, keyframe_interval)
+        self.file = open(path, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = []
+        self.ticks = 0
+        self.encoder = RaceEncoder(len(race["tortoises"]))
+        self.file.write(data)
+        self.record(race)
+
+    def record(self, race):
+        """Append the state of the race after its last tick."""
+        tick = self.ticks = race["tick"]
+        if tick % self.keyframe_interval == 0:
+            self.keyframes.append(self.file.tell())
+            self.file.write(self.encoder.keyframe(race))
+        else:
+            self.file.write(self.encoder.delta(race))
+
+    def close(self):
+        """Write the keyframe index and close the file."""
+        offset = self.file.tell()
+        self.file.write(INDEX.pack(b"I", self.ticks, len(self.keyframes)))
+        self.file.write(b"".join(OFFSET.pack(k) for k in self.keyframes))
+        self.file.write(TRAILER.pack(offset, END))
+        self.file.close()
+
+
+class ReplayPlayer(RaceDecoder):
+    """Read a replay file and rebuild the state of the race at any tick."""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.data = file.read()
+        self.seed, num_tortoises, finish_line, self.keyframe_interval, rules, self.names, _ = read_header(self.data, path)
+        super().__init__(num_tortoises, finish_line, rules)
+
+        index_offset, end = TRAILER.unpack_from(self.data, len(self.data) - TRAILER.size)
+        if end != END:
+            raise ValueError(f"{path} is truncated.")
+        _, self.num_ticks, count = INDEX.unpack_from(self.data, index_offset)
+        start = index_offset + INDEX.size
+        self.keyframes = [OFFSET.unpack_from(self.data, start + k * OFFSET.size)[0] for k in range(count)]
+        self._offset = None
+
+    def seek(self, tick):
+        """Move to the state after the given tick and return it."""
+        tick = max(0, min(tick, self.num_ticks))
+        self._booms = []  # Explosions before the new position are not shown
+        k = tick // self.keyframe_interval
+        offset = self.read_keyframe(self.data, self.keyframes[k])
+        for _ in range(tick - k * self.keyframe_interval):
+            offset = self.read_delta(self.data, offset)
+        self._offset = offset
+        return self.race
+
+    def advance(self):
+        """Move one tick forward and return the state, or None at the end of the replay."""
+        if self.race is None:
+            return self.seek(0)
+        if self.race["tick"] >= self.num_ticks:
+            return None
+        if (self.race["tick"] + 1) % self.keyframe_interval == 0:
+            self._offset = self.read_keyframe(self.data, self._offset)
+        else:
+            self._offset = self.read_delta(self.data, self._offset)
+        return self.race
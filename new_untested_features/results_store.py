@@ -0,0 +1,161 @@
+import argparse
+import csv
+import glob
+import os
+import time
+import uuid
+from datetime import datetime
+
+import sqlite_wal
+
+# Results of every race in a single SQLite file. Writes are buffered and sent in
+# batches, one transaction each; the database runs in WAL mode so that several race
+# processes can append to it while others read it.
+#
+#   races    race_id, finished_at (Unix time), variant, seed, number of tortoises
+#   results  race_id, position, tortoise, exploded, finished_at
+
+DEFAULT_PATH = "race_results.db"
+BATCH_SIZE = 1000  # Result rows buffered before they are written
+BUSY_TIMEOUT = 30  # Seconds to wait for another writer to finish its batch
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS races (
+    race_id TEXT PRIMARY KEY,
+    finished_at REAL NOT NULL,
+    variant TEXT,
+    seed INTEGER,
+    num_tortoises INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    race_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    tortoise TEXT NOT NULL,
+    exploded INTEGER NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (race_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS races_by_time ON races (finished_at);
+CREATE INDEX IF NOT EXISTS results_by_tortoise ON results (tortoise, finished_at);
+CREATE INDEX IF NOT EXISTS results_by_time ON results (finished_at);
+"""
+
+
+class ResultsStore:
+    """Append-only store of race results, use it as a context manager so that the last batch is written."""
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.connection = sqlite_wal.connect(path, BUSY_TIMEOUT)
+        self.connection.executescript(SCHEMA)
+        self._races = []
+        self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_race(self, results, variant=None, seed=None, race_id=None, finished_at=None):
+        """Buffer the results of a race and return its id.
+
+        results are (position, tortoise, exploded) tuples, exploded being a bool or
+        "Yes"/"No" as in the old CSV files.
+        """
+        race_id = race_id or uuid.uuid4().hex
+        finished_at = time.time() if finished_at is None else finished_at
+        self._races.append((race_id, finished_at, variant, seed, len(results)))
+        for position, tortoise, exploded in results:
+            if isinstance(exploded, str):
+                exploded = exploded == "Yes"
+            self._results.append((race_id, position, tortoise, int(exploded), finished_at))
+        if len(self._results) >= self.batch_size:
+            self.flush()
+        return race_id
+
+    def flush(self):
+        """Write the buffered races in one transaction."""
+        if not self._races:
+            return
+        with sqlite_wal.transaction(self.connection):
+            self.connection.executemany("INSERT INTO races VALUES (?, ?, ?, ?, ?)", self._races)
+            self.connection.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?)", self._results)
+        self._races = []
+        self._results = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    # Queries, all served by an index
+
+    def race(self, race_id):
+        """(position, tortoise, exploded) of every tortoise of a race, by position."""
+        rows = self.connection.execute(
+            "SELECT position, tortoise, exploded FROM results WHERE race_id = ? ORDER BY position", (race_id,)
+        )
+        return [(position, tortoise, bool(exploded)) for position, tortoise, exploded in rows]
+
+    def tortoise(self, tortoise, since=None, until=None):
+        """(finished_at, race_id, position, exploded) of every race of a tortoise, oldest first."""
+        rows = self.connection.execute(
+            "SELECT finished_at, race_id, position, exploded FROM results"
+            " WHERE tortoise = ? AND finished_at >= ? AND finished_at < ? ORDER BY finished_at",
+            (tortoise, float("-inf") if since is None else since, float("inf") if until is None else until),
+        )
+        return [(finished_at, race_id, position, bool(exploded)) for finished_at, race_id, position, exploded in rows]
+
+    def races(self, since=None, until=None):
+        """(finished_at, race_id, variant, seed, num_tortoises) of the races in a time range, oldest first."""
+        return self.connection.execute(
+            "SELECT finished_at, race_id, variant, seed, num_tortoises FROM races"
+            " WHERE finished_at >= ? AND finished_at < ? ORDER BY finished_at",
+            (float("-inf") if since is None else since, float("inf") if until is None else until),
+        ).fetchall()
+
+    def count(self):
+        """Number of races in the store."""
+        return self.connection.execute("SELECT count(*) FROM races").fetchone()[0]
+
+
+def import_csv(store, paths):
+    """Move the race_results_<timestamp>.csv files of the old save_results() into the store."""
+    imported = 0
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            finished_at = datetime.strptime(name[len("race_results_"):], "%Y-%m-%d_%H-%M-%S").timestamp()
+        except ValueError:
+            finished_at = os.path.getmtime(path)
+        with open(path, newline="") as file:
+            rows = list(csv.reader(file))[1:]  # Skip the header
+        store.add_race([(int(position), tortoise, exploded) for position, tortoise, exploded in rows],
+                       variant="v4.2", finished_at=finished_at)
+        imported += 1
+    store.flush()
+    return imported
+
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the race results store")
+    parser.add_argument("--db", default=DEFAULT_PATH, help=f"Results database (default: {DEFAULT_PATH})")
+    parser.add_argument("--race", default=None, help="Show the results of a race")
+    parser.add_argument("--tortoise", default=None, help="Show the races of a tortoise")
+    parser.add_argument("--import_csv", nargs="+", default=None, help="Import CSV files of the old results, glob patterns allowed")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.import_csv:
+            paths = [path for pattern in args.import_csv for path in sorted(glob.glob(pattern))]
+            print(f"{import_csv(store, paths)} races imported")
+        if args.race:
+            for position, tortoise, exploded in store.race(args.race):
+                print(f"{position}. {tortoise} {'(Exploded)' if exploded else ''}")
+        if args.tortoise:
+            for finished_at, race_id, position, exploded in store.tortoise(args.tortoise):
+                when = datetime.fromtimestamp(finished_at).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"{when}  {race_id}  {position}{' (Exploded)' if exploded else ''}")
+        print(f"{store.count()} races in {args.db}")
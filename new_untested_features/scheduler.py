@@ -0,0 +1,63 @@
+import time
+
+MAX_TICKS_PER_FRAME = 20  # Ticks run back to back before a frame is shown anyway, times the speed above 1
+
+
+class FixedTimestep:
+    """Advance a simulation at a constant logical rate and draw it at its own rate.
+
+    The simulation runs every tick that is due, however long the frames take to
+    draw, so the outcome does not depend on the speed of the machine. Frames are
+    drawn at most once per frame_time; when drawing falls behind, the late frames
+    are skipped instead of slowing the simulation down.
+
+    speed and paused can be changed while it runs, from update() or render(): the
+    ticks come speed times faster, or not at all, from the next one on. Without a
+    frame_time, a frame is drawn for every tick, but no more often than at speed 1.
+    """
+
+    def __init__(self, tick_time, frame_time=None, clock=time.perf_counter, sleep=time.sleep, speed=1.0):
+        self.tick_time = tick_time
+        self.frame_time = frame_time
+        self.clock = clock
+        self.sleep = sleep
+        self.speed = speed
+        self.paused = False
+        self.ticks = 0
+        self.frames = 0
+        self.skipped_frames = 0
+
+    def run(self, update, render, done):
+        """Call update() once per tick and render() once per frame until done() is true."""
+        now = self.clock()
+        next_tick = now
+        next_frame = now
+        while not done():
+            tick_time = self.tick_time / self.speed
+            frame_time = self.frame_time or max(self.tick_time, tick_time)
+
+            # Simulation: run every tick that is due, several per frame above speed 1, none while paused
+            ticks = 0
+            max_ticks = MAX_TICKS_PER_FRAME * max(1, self.speed)
+            if self.paused:
+                next_tick = now + tick_time  # The time spent paused is not owed to the simulation
+            while next_tick <= now and ticks < max_ticks and not done():
+                update()
+                next_tick += tick_time
+                self.ticks += 1
+                ticks += 1
+
+            # Rendering: one frame at most, skipping the ones we are late for
+            if now >= next_frame or done():
+                render()
+                self.frames += 1
+                missed = int((now - next_frame) / frame_time)
+                if missed > 0:
+                    self.skipped_frames += missed
+                next_frame += (max(missed, 0) + 1) * frame_time
+
+            # Sleep until the next tick or frame is due
+            delay = min(next_tick, next_frame) - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            now = self.clock()
@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import curses
+import random
+import struct
+
+import race_engine
+import replay
+from renderer import DiffRenderer
+from layout import Layout
+from tortoise_rushv8 import NAMES, draw_race, init_colors, relayout, tortoise_colors
+
+# Spectator mode: one process runs the races and streams them over a local socket, any
+# number of spectators draw them in their own terminal. The stream is made of the
+# records of a replay: the header of a race and a keyframe of its state when it starts
+# or when a spectator joins, then one delta per tick with only the tortoises that moved
+# or changed status. Every message is prefixed with its length.
+#
+#   header    replay header of a new race
+#   keyframe  b"K" record of the replay, the full state
+#   delta     b"D" record of the replay, the changes of one tick
+#   over      b"E", the race is over
+#
+# A tick is encoded once whatever the number of spectators. A spectator whose socket
+# cannot take the stream as fast as it comes is skipped until its buffer drains, then
+# gets a keyframe and goes on from there: slow spectators drop frames, the race and the
+# others never wait for them.
+
+MESSAGE_LENGTH = struct.Struct("<I")
+OVER = b"E"
+HIGH_WATER = 64 * 1024  # Bytes waiting in the socket of a spectator before its frames are dropped
+RESULTS_TIME = 10  # Seconds between the end of a race and the start of the next one
+FINISH_LINE = 70
+PORT = 8765
+
+
+def message(payload):
+    return MESSAGE_LENGTH.pack(len(payload)) + payload
+
+
+async def read_message(reader):
+    (length,) = MESSAGE_LENGTH.unpack(await reader.readexactly(MESSAGE_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+class Spectator:
+    """Connection of a spectator, and whether it needs a keyframe to catch up."""
+
+    __slots__ = ("writer", "behind", "dropped")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.behind = False
+        self.dropped = 0  # Ticks of the race skipped while its socket was full
+
+
+class RaceServer:
+    """Run races back to back and stream them to every spectator connected."""
+
+    def __init__(self, num_tortoises, rules=race_engine.STABLE_RULES, finish_line=FINISH_LINE, seed=None, races=None):
+        if num_tortoises > replay.MAX_TORTOISES:
+            raise ValueError(f"The races are streamed as replays, which hold {replay.MAX_TORTOISES} tortoises at most.")
+        self.num_tortoises = num_tortoises
+        self.rules = rules
+        self.finish_line = finish_line
+        self.rng = random.Random(seed)
+        self.races = races  # Number of races to run, None to run them forever
+        self.names = [NAMES[i % len(NAMES)] for i in range(num_tortoises)]
+        self.spectators = set()
+        self._connections = set()  # Tasks serving the spectators
+        self.race = None
+        self.encoder = None
+        self._header = None
+
+    async def handle(self, reader, writer):
+        """Connection of a spectator: the race as it stands, then the stream until it leaves."""
+        spectator = Spectator(writer)
+        self._connections.add(asyncio.current_task())
+        if self.race is not None:
+            writer.write(self._header + message(self.encoder.keyframe(self.race)))
+            if self.race["over"]:
+                writer.write(message(OVER))
+        self.spectators.add(spectator)
+        try:
+            await reader.read()  # Spectators send nothing, this returns when they leave
+        except ConnectionError:
+            pass
+        finally:
+            self.spectators.discard(spectator)
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    def broadcast(self, delta):
+        """Send the delta of a tick, a keyframe instead to the spectators that fell behind and can take it again."""
+        keyframe = None
+        for spectator in list(self.spectators):
+            transport = spectator.writer.transport
+            if transport.is_closing():
+                self.spectators.discard(spectator)
+            elif transport.get_write_buffer_size() > HIGH_WATER:
+                spectator.behind = True
+                spectator.dropped += 1
+            elif spectator.behind:
+                keyframe = keyframe or message(self.encoder.keyframe(self.race))
+                spectator.writer.write(keyframe)
+                spectator.behind = False
+            else:
+                spectator.writer.write(delta)
+
+    def announce(self, payload):
+        """Send a message nobody may miss, the spectators that fell behind get a keyframe first."""
+        keyframe = None
+        for spectator in list(self.spectators):
+            if spectator.behind:
+                keyframe = keyframe or message(self.encoder.keyframe(self.race))
+                spectator.writer.write(keyframe)
+                spectator.behind = False
+            spectator.writer.write(payload)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        count = 0
+        while self.races is None or count < self.races:
+            seed = self.rng.randrange(2**32)
+            race = race_engine.new_race(self.num_tortoises, self.finish_line, self.rules, random.Random(seed))
+            self.encoder = replay.RaceEncoder(self.num_tortoises)
+            self._header = message(replay.header(race, seed, self.names))
+            for spectator in self.spectators:
+                spectator.behind = False  # The new race starts from a keyframe for everybody
+                spectator.dropped = 0
+            self.race = race
+            self.announce(self._header + message(self.encoder.keyframe(race)))
+
+            # Ticks on a fixed schedule, a late tick is run at once rather than shifting the next ones
+            next_tick = loop.time()
+            while not race["over"]:
+                next_tick += self.rules["frame_time"]
+                await asyncio.sleep(max(0, next_tick - loop.time()))
+                race_engine.step(race)
+                self.broadcast(message(self.encoder.delta(race)))
+            self.announce(message(OVER))
+            count += 1
+
+            dropped = sum(spectator.dropped for spectator in self.spectators)
+            winner = self.names[race["finished"][0]] if race["finished"] else "nobody"
+            print(f"Race {count} (seed {seed}) won by {winner}, {len(self.spectators)} spectators, {dropped} frames dropped")
+            if self.races is None or count < self.races:
+                await asyncio.sleep(RESULTS_TIME)
+
+    async def close(self):
+        """Close the connections of the spectators, once the last race is over."""
+        for spectator in self.spectators:
+            spectator.writer.close()
+        await asyncio.gather(*self._connections)
+
+
+async def serve(server, host="127.0.0.1", port=PORT, path=None):
+    if path:
+        listener = await asyncio.start_unix_server(server.handle, path)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        await server.run()
+        await server.close()
+
+
+class Stream:
+    """Races received from the server, rebuilt as states of race_engine."""
+
+    def __init__(self):
+        self.decoder = None  # Decoder of the current race, a new one for every race
+        self.seed = None
+        self.names = None
+
+    def apply(self, data):
+        if data.startswith(replay.MAGIC):
+            self.seed, num_tortoises, finish_line, _, rules, self.names, _ = replay.read_header(data, "The stream")
+            self.decoder = replay.RaceDecoder(num_tortoises, finish_line, rules)
+        elif data[:1] == b"K":
+            self.decoder.read_keyframe(data, 0)
+        elif data[:1] == b"D":
+            self.decoder.read_delta(data, 0)
+        elif data == OVER:
+            self.decoder.race["over"] = True
+
+    async def receive(self, reader):
+        while True:
+            self.apply(await read_message(reader))
+
+
+async def spectate(stdscr, reader, fps=None, viewport=False):
+    """Draw the races of the stream as they come, until the server leaves or q is pressed."""
+    curses.curs_set(0)  # Hide the cursor
+    stdscr.nodelay(True)  # Read the keys without waiting for them
+    num_colors = init_colors()
+
+    stream = Stream()
+    receiving = asyncio.ensure_future(stream.receive(reader))
+    shown = None  # Decoder of the race on screen
+    drawn = None  # Tick on screen
+    while True:
+        key = stdscr.getch()
+        if key == ord("q"):
+            receiving.cancel()
+            return
+        decoder = stream.decoder
+        if decoder is not None and decoder is not shown and decoder.race is not None:
+            # A new race: new lanes, new colors, a blank screen
+            shown = decoder
+            drawn = None
+            layout = Layout(decoder.num_tortoises, decoder.finish_line, *stdscr.getmaxyx(), viewport)
+            colors = tortoise_colors(stream.seed, decoder.num_tortoises, num_colors)
+            renderer = DiffRenderer(stdscr)
+            scenery = {}
+            stdscr.clear()
+            renderer.invalidate()
+        while key != -1:
+            if shown is not None and key == curses.KEY_RESIZE:
+                relayout(stdscr, layout, renderer, scenery)
+                drawn = None
+            elif shown is not None and layout.viewport.handle_key(key):
+                drawn = None
+            key = stdscr.getch()
+
+        # Only the ticks received since the last frame are drawn, the ones in between are skipped
+        if shown is not None and drawn != (shown.race["tick"], shown.race["over"]):
+            race = shown.race
+            drawn = (race["tick"], race["over"])
+            if race["over"]:
+                winner = stream.names[race["finished"][0]] if race["finished"] else "Nobody"
+                renderer.addstr_static(0, 0, f"{winner} wins! Next race soon...", curses.A_BOLD)
+            draw_race(renderer, race, stream.names, colors, layout, scenery)
+        if receiving.done():
+            break
+        await asyncio.sleep(1 / fps if fps else shown.rules["frame_time"] if shown else 0.05)
+
+    # The last race stays on screen until a key is pressed
+    stdscr.nodelay(False)
+    stdscr.getch()
+    receiving.result()  # The reason the stream stopped
+
+
+async def connect(stdscr, host="127.0.0.1", port=PORT, path=None, fps=None, viewport=False):
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await spectate(stdscr, reader, fps, viewport)
+    finally:
+        writer.close()
+
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tortoise Rush spectator mode: one race, many screens")
+    parser.add_argument("--serve", action="store_true", help="Run the races and stream them, instead of watching them")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the server (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=PORT, help=f"TCP port of the server (default: {PORT})")
+    parser.add_argument("--unix", default=None, help="Path of a Unix socket to use instead of TCP")
+    parser.add_argument("--num_tortoises", type=int, default=5, help="Number of tortoises in the races (default: 5)")
+    parser.add_argument("--rules", choices=race_engine.VARIANTS, default="stable", help="Rules of the races (default: stable)")
+    parser.add_argument("--finish_line", type=int, default=FINISH_LINE, help=f"Column of the finish line (default: {FINISH_LINE})")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the races, to run them again (default: random)")
+    parser.add_argument("--races", type=int, default=None, help="Number of races to run (default: no end)")
+    parser.add_argument("--fps", type=float, default=None, help="Frames drawn per second (default: one per tick)")
+    parser.add_argument("--viewport", action="store_true", help="Show one row per lane and scroll, even if the field fits on screen")
+    args = parser.parse_args()
+
+    try:
+        if args.serve:
+            server = RaceServer(args.num_tortoises, race_engine.VARIANTS[args.rules], args.finish_line, args.seed, args.races)
+            asyncio.run(serve(server, args.host, args.port, args.unix))
+        else:
+            curses.wrapper(lambda stdscr: asyncio.run(connect(stdscr, args.host, args.port, args.unix, args.fps, args.viewport)))
+    except ValueError as e:
+        print(str(e))
+    except (ConnectionError, asyncio.IncompleteReadError):
+        print("The server closed the stream.")
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,31 @@
+import contextlib
+import sqlite3
+
+# SQLite files written by several processes at once, like the results store and the
+# betting ledger: WAL mode, so that readers never wait for a writer, and transactions
+# that take the write lock as soon as they begin.
+
+
+def connect(path, busy_timeout, synchronous="NORMAL", **kwargs):
+    """Open path in WAL mode, in autocommit outside of transaction().
+
+    With synchronous NORMAL the last commits can be lost on power failure, the
+    file stays consistent; FULL syncs every commit to disk before it returns.
+    """
+    connection = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, **kwargs)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(f"PRAGMA synchronous={synchronous}")
+    return connection
+
+
+@contextlib.contextmanager
+def transaction(connection):
+    """Run the block in one transaction, rolled back if it raises."""
+    # BEGIN IMMEDIATE takes the write lock at once, another writer waits for it instead of failing
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
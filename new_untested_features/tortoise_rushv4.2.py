@@ -2,8 +2,8 @@ import curses
 import time
 import random
 import argparse
-import csv
-from datetime import datetime
+
+from results_store import ResultsStore
 
 # Define characters
 TORTOISE = "🐢"
@@ -14,14 +14,10 @@ BOOM = "BOOOOOOM!"
 NAMES = ["Angelo", "Giacomo", "SALSALSAL", "Ludo", "Arianna", "Matteo", "nonba","Mancini", "G B ", "Quaglia", "Dash", "Zoom", "Swift", "Blaze", "Thunder", "Rocket", "Comet", "SERSE"]
 
 def save_results(results):
-    """Save race results to a CSV file."""
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = f"race_results_{timestamp}.csv"
-    with open(filename, mode="w", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Position", "Tortoise Name", "Exploded"])
-        writer.writerows(results)
-    print(f"Results saved to {filename}")
+    """Append race results to the results store."""
+    with ResultsStore() as store:
+        race_id = store.add_race(results, variant="v4.2")
+    print(f"Results saved to {store.path} as race {race_id}")
 
 def main(stdscr, num_tortoises):
     curses.curs_set(0)  # Hide the cursor
@@ -179,7 +175,7 @@ def main(stdscr, num_tortoises):
         stdscr.addstr(2 + i, width // 2 - 15, f"{pos}. {name} {'(Exploded)' if exploded == 'Yes' else ''}", color)
     stdscr.refresh()
 
-    # Save results to CSV
+    # Save results to the results store
     save_results(positions)
     time.sleep(1)
     stdscr.getch()
@@ -92,7 +92,6 @@ def main(stdscr, num_tortoises):
         for tortoise in tortoises:
             # Skip exploded tortoises
             if tortoise["exploded"]:
-                total_exploded += 1
                 continue
 
             # Randomly place a bomb with a small chance
@@ -112,6 +111,7 @@ def main(stdscr, num_tortoises):
                     # Bomb explodes
                     stdscr.addstr(tortoise["y"], bomb["x"], BOOM, curses.A_BOLD)
                     tortoise["exploded"] = True
+                    total_exploded += 1  # Counted once, when the bomb goes off
                     del bombs[tortoise["name"]]
                     continue
 
@@ -94,7 +94,6 @@ def main(stdscr, num_tortoises):
         for tortoise in tortoises:
             # Skip exploded tortoises
             if tortoise["exploded"]:
-                total_exploded += 1
                 if tortoise["boom_frame"] and frame_counter - tortoise["boom_frame"] < 30:  # Display BOOM for 3 seconds (30 frames)
                     stdscr.addstr(tortoise["y"], tortoise["bomb_x"], BOOM, curses.A_BOLD)
                 continue
@@ -117,6 +116,7 @@ def main(stdscr, num_tortoises):
                     tortoise["boom_frame"] = frame_counter
                     stdscr.addstr(tortoise["y"], tortoise["bomb_x"], BOOM, curses.A_BOLD)
                     tortoise["exploded"] = True
+                    total_exploded += 1  # Counted once, when the bomb goes off
                     tortoise["bomb_x"] = None  # Reset bomb position
                     tortoise["bomb_timer"] = None  # Reset bomb timer
                     continue
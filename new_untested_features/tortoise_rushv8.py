@@ -0,0 +1,487 @@
+import contextlib
+import curses
+import time
+import random
+import argparse
+import os
+
+import betting
+import odds
+import race_engine
+from profiler import HUD, IDLE, INPUT, REFRESH, SIMULATE, TORTOISES, TRACKS, FrameProfiler
+from renderer import DiffRenderer
+from replay import MAX_TORTOISES, ReplayPlayer, ReplayRecorder
+from results_store import ResultsStore
+from scheduler import FixedTimestep
+from keyboard import Keyboard
+from layout import Layout
+
+# Define the tortoise, bomb and explosion characters
+TORTOISE = "🐢"
+BOMB = "💣"
+BOOM = "BOOOOOOM!"
+
+# Keys during the race
+KEYS = ("[space] pause  [+/-/1] speed  [s] skip to the results  [t/T] track a tortoise  [f] follow the leaders"
+        "  [arrows] scroll  [q] quit")
+MIN_SPEED = 0.25
+MAX_SPEED = 32
+
+MAX_SEED = 2**63 - 1  # Largest seed both the replays and the results store hold
+
+# List of example tortoise names
+NAMES = ["Angelo", "Giacomo", "SALSALSAL", "Ludo", "Arianna", "Matteo", "Giulia", "samuuu", "nonba","Mancini", "G B ", "Quaglia", "Giorgia", "Daniela", "Bea", "Anastasia", "Ivan", "Luca", "SERSE"]
+
+def init_colors():
+    curses.start_color()
+    num_colors = min(7, curses.COLORS - 1)
+    for i in range(1, num_colors + 1):
+        curses.init_pair(i, i, curses.COLOR_BLACK)
+    return num_colors
+
+def tortoise_colors(seed, num_tortoises, num_colors):
+    # Colors come from their own generator, so they do not change the race of a seed
+    rng = random.Random(seed)
+    return [rng.randint(1, num_colors) for _ in range(num_tortoises)]
+
+def draw_scenery(addstr, y, i, names, colors, layout):
+    addstr(y, 0, "-" * layout.width)  # Track line
+    addstr(y + layout.viewport.lane_height - 1, layout.finish_column, "|")  # Finish line
+    addstr(y, 0, f"{names[i]:<10}", curses.color_pair(colors[i]))  # Print name
+
+def draw_tortoise(addstr, y, i, race, names, colors, layout):
+    tortoises = race["tortoises"]
+    x = layout.column(tortoises.x[i])
+    if tortoises.status[i] == race_engine.FINISHED:
+        addstr(y, layout.finish_column, f"{tortoises.place[i]} {names[i]:<5}", curses.A_BOLD)  # Print position in white
+    elif tortoises.status[i] == race_engine.RACING:
+        if tortoises.bomb[i] >= 0:
+            addstr(y, x + 8, f"{tortoises.bomb[i]}")  # Print bomb countdown
+            addstr(y, x + 10, BOMB)  # Print bomb
+        addstr(y, x + 12, TORTOISE, curses.color_pair(colors[i]))  # Print tortoise
+    elif i in race["booming"]:
+        addstr(y, x + 12, BOOM, curses.A_BOLD)  # Print explosion, for a few frames
+
+def standing(race, i):
+    """Where tortoise i stands in the race, as text."""
+    tortoises = race["tortoises"]
+    if tortoises.status[i] == race_engine.FINISHED:
+        return f"finished {tortoises.place[i]}°"
+    if tortoises.status[i] == race_engine.EXPLODED:
+        return "exploded"
+    if race["over"]:
+        return "did not finish"
+    x = tortoises.x[i]
+    place = len(race["finished"]) + 1 + sum(tortoises.x[j] > x for j in race["active"])
+    return f"{place}° of {len(tortoises.x)}, {max(0, race['finish_line'] - x):.0f} to go"
+
+def draw_race(renderer, race, names, colors, layout, scenery, profiler=None):
+    """Draw a frame of the race.
+
+    scenery maps the row of every lane in the static layer of the renderer to the
+    lane and whether it is settled, it is kept from one frame to the next: the
+    tracks, finish line and names are drawn once, and the lanes that will not
+    change anymore are drawn whole. Empty it and the static layer to draw them again.
+    """
+    tortoises = race["tortoises"]
+    viewport = layout.viewport
+    lane_height = viewport.lane_height
+
+    # Only the lanes on screen are drawn, whatever the size of the field
+    viewport.update(race)
+    lanes = viewport.lanes()
+
+    # Lanes that scrolled away take their static rows with them
+    rows = {y: i for y, i in lanes}
+    for y in [y for y, (i, _) in scenery.items() if rows.get(y) != i]:
+        del scenery[y]
+        for row in range(y, y + lane_height):
+            renderer.clear_static(row)
+
+    # The scenery of the lanes that came on screen, under every frame from now on
+    for y, i in lanes:
+        if y not in scenery:
+            draw_scenery(renderer.addstr_static, y, i, names, colors, layout)
+            scenery[y] = (i, False)
+    if profiler:
+        profiler.mark(TRACKS)
+
+    # What runs on the tracks, once more in the static layer for the lanes that will not change anymore
+    for y, i in lanes:
+        if scenery[y][1]:
+            continue  # Settled
+        if tortoises.status[i] == race_engine.RACING or i in race["booming"]:
+            draw_tortoise(renderer.addstr, y, i, race, names, colors, layout)
+        else:
+            draw_tortoise(renderer.addstr_static, y, i, race, names, colors, layout)
+            scenery[y] = (i, True)
+    if profiler:
+        profiler.mark(TORTOISES)
+
+    # The tracked tortoise: a mark on its lane and how it is doing
+    if viewport.track is not None:
+        for y, i in lanes:
+            if i == viewport.track:
+                renderer.addstr(y, 10, ">", curses.A_BOLD)
+        renderer.addstr(1, 0, f"Tracking {names[viewport.track]}: {standing(race, viewport.track)}", curses.A_BOLD)
+
+    # Display the timeout timer
+    remaining_time = race_engine.time_left(race)
+    if remaining_time is not None:
+        renderer.addstr(0, layout.width // 2 - 10, f"Time left: {remaining_time:.2f} seconds", curses.A_BOLD)
+
+    # Explain how to move around a field larger than the screen
+    if viewport.size < viewport.num_lanes:
+        renderer.addstr(renderer.height - 1, 0, viewport.status()[:layout.width - 1])
+    if profiler:
+        profiler.mark(HUD)
+
+    # Send the changes to the screen
+    renderer.present()
+    if profiler:
+        profiler.mark(REFRESH)
+        profiler.end_frame()
+
+def relayout(stdscr, layout, renderer, scenery):
+    """Lay the race out again for the new size of the terminal, the next frame draws it whole.
+
+    The scenery is kept if the tracks did not change, but for the lanes cut off at the bottom.
+    """
+    height, width = stdscr.getmaxyx()
+    stdscr.clear()
+    renderer.resize(height, width)
+    if layout.resize(height, width):
+        scenery.clear()
+        renderer.clear_static()
+        return
+    lane_height = layout.viewport.lane_height
+    for y in [y for y in scenery if y + lane_height > height]:
+        del scenery[y]
+        for row in range(y, y + lane_height):
+            renderer.clear_static(row)
+
+def watch_race(stdscr, race, names, colors, advance, tick_time, fps=None, viewport=False, profiler=None, speed=1.0):
+    """Show the race while advance() moves it forward, one call every tick_time seconds.
+
+    The keys take effect in the next frame: see KEYS. The speed only changes how
+    often advance() is called, never the race. A race skipped with s or left with q
+    is run to its end off screen, through advance() as well, so it ends as it would
+    have on screen. Returns True if it was left with q. With a profiler.FrameProfiler,
+    the time of every phase of the frames is measured.
+    """
+    height, width = stdscr.getmaxyx()
+    layout = Layout(len(names), race["finish_line"], height, width, viewport)
+
+    # Only the cells that change between frames are sent to the terminal
+    renderer = DiffRenderer(stdscr)
+    scenery = {}  # Row of each lane drawn in the static layer
+    keyboard = Keyboard(stdscr)  # Read the keys without stopping the race
+    left = skipped = False  # With q or s
+
+    def render():
+        nonlocal left, skipped
+        if profiler:
+            profiler.start()
+        for key in keyboard.keys():
+            if key == curses.KEY_RESIZE:
+                relayout(stdscr, layout, renderer, scenery)
+            elif key in (ord(" "), ord("p")):
+                timestep.paused = not timestep.paused
+            elif key in (ord("+"), ord("=")):
+                timestep.speed = min(timestep.speed * 2, MAX_SPEED)
+            elif key == ord("-"):
+                timestep.speed = max(timestep.speed / 2, MIN_SPEED)
+            elif key == ord("1"):
+                timestep.speed = 1.0
+            elif key == ord("s"):
+                skipped = True
+            elif key == ord("q"):
+                left = True
+            else:
+                layout.viewport.handle_key(key)
+        if profiler:
+            profiler.mark(INPUT)
+
+        # Pause and speed, right of the tracked tortoise
+        playback = ("PAUSED " if timestep.paused else "") + (f"x{timestep.speed:g}" if timestep.speed != 1 else "")
+        if playback:
+            renderer.addstr(1, layout.width - len(playback) - 1, playback, curses.A_BOLD)
+        draw_race(renderer, race, names, colors, layout, scenery, profiler)
+
+    # The race advances at its own pace, the screen at its own frame rate
+    sleep = keyboard.wait  # Woken up by the keys
+    if profiler:
+        advance = profiler.timed(SIMULATE, advance)
+        sleep = profiler.timed(IDLE, sleep)
+    timestep = FixedTimestep(tick_time, 1 / fps if fps else None, sleep=sleep, speed=speed)
+    timestep.run(advance, render, lambda: race["over"] or left or skipped)
+    keyboard.close()
+    while not race["over"]:
+        advance()
+    return left
+
+def clipped(stdscr):
+    """addstr() of the window that drops what falls off it, whatever its size is now."""
+    def addstr(y, x, text, attr=0):
+        height, width = stdscr.getmaxyx()
+        if not 0 <= y < height or x >= width:
+            return
+        if x < 0:
+            text, x = text[-x:], 0
+        try:
+            stdscr.addstr(y, x, text[:width - x], attr)
+        except curses.error:
+            pass  # Writing the bottom right cell moves the cursor off the window
+    return addstr
+
+def wait_key(stdscr, draw):
+    """Show draw() until a key is pressed, drawing it again whenever the terminal is resized."""
+    draw()
+    key = stdscr.getch()
+    while key == curses.KEY_RESIZE:
+        draw()
+        key = stdscr.getch()
+    return key
+
+def draw_results(stdscr, finished_tortoises, seed):
+    height, width = stdscr.getmaxyx()
+    addstr = clipped(stdscr)
+
+    # Declare the results
+    stdscr.clear()
+    addstr(height // 2 - len(finished_tortoises) // 2 - 6, width // 2 - 10, "Race Results:", curses.A_BOLD)
+
+    # Podium heights
+    podium_heights = [10, 7, 5]
+
+    # Draw podium
+    base_width = width // 8
+    spacing = 2  # Spacing between columns
+    center_x =8 + width // 2 - base_width - spacing  # Shift the podium to the left
+    base_y = height // 2 + max(podium_heights) // 2
+
+    # Define colors for the podium
+    GOLD = 3
+    SILVER = 7
+    BRONZE = 6
+
+    positions = [
+        {"label": "2°", "x_offset": -(base_width + spacing), "height": podium_heights[1], "color": SILVER, "name": finished_tortoises[1] if len(finished_tortoises) > 1 else ""},
+        {"label": "1°", "x_offset": 0, "height": podium_heights[0], "color": GOLD, "name": finished_tortoises[0] if len(finished_tortoises) > 0 else ""},
+        {"label": "3°", "x_offset": base_width + spacing, "height": podium_heights[2], "color": BRONZE, "name": finished_tortoises[2] if len(finished_tortoises) > 2 else ""},
+    ]
+
+    # Draw each podium column
+    for pos in positions:
+        col_x = center_x + pos["x_offset"]
+        col_y = base_y - pos["height"]
+
+        for row in range(pos["height"]):
+            addstr(col_y + row, col_x, " " * base_width, curses.color_pair(pos["color"]) | curses.A_REVERSE)
+
+        addstr(col_y - 1, col_x + base_width // 2 - len(pos["label"]) // 2, pos["label"], curses.A_BOLD)
+        if pos["name"]:
+            addstr(col_y - 2, col_x + base_width // 2 - len(pos["name"]) // 2, pos["name"], curses.A_BOLD)
+
+    # Display the rest of the results, as many as fit on screen
+    for idx, name in enumerate(finished_tortoises[3:max(0, height - base_y - 2)]):
+        addstr(base_y + idx + 1, width // 2 - 10, f"{idx + 4}. {name}", curses.A_BOLD)
+
+    # The seed is enough to replay the race with --seed
+    addstr(height - 1, 0, f"Seed: {seed}")
+
+    stdscr.refresh()
+
+def show_results(stdscr, finished_tortoises, seed):
+    wait_key(stdscr, lambda: draw_results(stdscr, finished_tortoises, seed))
+
+def main(stdscr, num_tortoises, odds_budget=0.3, fps=None, seed=None, record=None, viewport=False, bets=None,
+         rules="stable", save_results=False, profile=False, speed=1.0, bets_key=None):
+    curses.curs_set(0)  # Hide the cursor
+    stdscr.nodelay(False)  # Wait for user input
+    stdscr.clear()
+
+    # Initialize colors
+    num_colors = init_colors()
+
+    # Terminal dimensions
+    height, width = stdscr.getmaxyx()
+
+    # Define the finish line, the layout scales it to the terminal if it is resized
+    finish_line = width - 10  # Leave some space for visibility
+
+    # Fields taller than the terminal are shown through a scrolling viewport
+    layout = Layout(num_tortoises, finish_line, height, width, viewport)
+
+    # Every race has a seed, so that it can be reproduced
+    if seed is None:
+        seed = random.randrange(2**32)
+
+    # The race itself runs in the engine with the rules of one of the variants, here we only
+    # keep what is needed to draw it
+    names = [NAMES[i % len(NAMES)] for i in range(num_tortoises)]
+    store = ResultsStore() if save_results else None
+    extra_modes = [race_engine.Export(store, names, rules, seed)] if store else []
+    race = race_engine.new_race(num_tortoises, finish_line, race_engine.VARIANTS[rules], random.Random(seed), extra_modes)
+    colors = tortoise_colors(seed, num_tortoises, num_colors)
+
+    # Step 1: Display static tortoises and their odds with "Choose your fighter!!" prompt
+    table = odds.estimate_odds(num_tortoises, finish_line, race["rules"], odds_budget)
+
+    # The betting service takes bets until the race starts
+    book = betting.BettingClient(bets, bets_key) if bets else None
+    if book:
+        book.request("open", names=names, ranked=not race["rules"]["single_winner"])
+    settled = False
+    try:
+        def draw_fighters():
+            height, width = stdscr.getmaxyx()
+            layout.resize(height, width)
+            addstr = clipped(stdscr)
+            stdscr.clear()
+            addstr(0, 16, f"Odds over {table['races']} simulated races (95% confidence)")
+            addstr(1, 16, KEYS)
+            for y, i in layout.viewport.lanes():
+                addstr(y, 0, f"{names[i]:<10}")  # Print tortoise name
+                addstr(y, 12, TORTOISE, curses.color_pair(colors[i]))  # Print tortoise
+                addstr(y, 16, odds.format_odds(table, i))  # Print odds
+            if book:
+                addstr(height - 3, width // 2 - 10, f"Bets open at {bets}")
+            addstr(height - 2, width // 2 - 10, "Choose your fighter!!", curses.A_BOLD)
+            addstr(height - 1, width // 2 - 15, "Press any key to start the race!", curses.A_BOLD)
+            stdscr.refresh()
+
+        # Step 2: Wait for a keystroke to start the race
+        wait_key(stdscr, draw_fighters)
+
+        # Step 3: Display "READY, STEADY, GO!" sequence, no more bets
+        if book:
+            book.request("lock")
+        height, width = stdscr.getmaxyx()
+        addstr = clipped(stdscr)
+        stdscr.clear()
+        addstr(height // 2 - 2, width // 2 - 6, "READY!", curses.A_BOLD)
+        stdscr.refresh()
+        time.sleep(1)
+        addstr(height // 2 - 1, width // 2 - 7, "STEADY!", curses.A_BOLD)
+        stdscr.refresh()
+        time.sleep(1)
+        addstr(height // 2, width // 2 - 4, "GO!", curses.A_BOLD)
+        stdscr.refresh()
+        time.sleep(1)
+        stdscr.clear()
+        stdscr.refresh()
+        curses.flushinp()  # The keys typed before the start do not play in the race
+
+        # Step 4: Start the race, recording it if asked to
+        recorder = ReplayRecorder(record, race, seed, names) if record else None
+
+        def advance():
+            race_engine.step(race)
+            if recorder:
+                recorder.record(race)
+
+        tick_time = race["rules"]["frame_time"]
+        profiler = FrameProfiler(1 / fps if fps else tick_time) if profile else None
+        left = watch_race(stdscr, race, names, colors, advance, tick_time, fps, viewport, profiler, speed)
+        if recorder:
+            recorder.close()
+        if store:
+            store.close()
+        if book:
+            book.request("settle", order=race["finished"])
+            settled = True
+    finally:
+        # A race that did not run to its end, stopped by Ctrl-C or an error, gives the stakes back
+        if book:
+            if not settled:
+                with contextlib.suppress(ValueError, OSError):  # The service refunds them when it starts again
+                    book.request("void")
+            book.close()
+
+    if not left:
+        show_results(stdscr, [names[i] for i in race["finished"]], seed)
+    return profiler
+
+def watch_replay(stdscr, path, speed=1.0, fps=None, start_tick=0, viewport=False, profile=False):
+    curses.curs_set(0)  # Hide the cursor
+    stdscr.nodelay(False)  # Wait for user input
+    stdscr.clear()
+    num_colors = init_colors()
+
+    # The replay already holds every tick, nothing is simulated again
+    player = ReplayPlayer(path)
+    player.seek(start_tick)
+    colors = tortoise_colors(player.seed, player.num_tortoises, num_colors)
+
+    tick_time = player.rules["frame_time"]
+    profiler = FrameProfiler(1 / fps if fps else tick_time) if profile else None
+    if not watch_race(stdscr, player.race, player.names, colors, player.advance, tick_time, fps, viewport, profiler, speed):
+        show_results(stdscr, [player.names[i] for i in player.race["finished"]], player.seed)
+    return profiler
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tortoise race animation!", epilog=f"Keys during the race: {KEYS}")
+    parser.add_argument(
+        "--num_tortoises", type=int, default=5, help="Number of tortoises in the race (default: 5)"
+    )
+    parser.add_argument(
+        "--odds_budget", type=float, default=0.3, help="Seconds spent estimating the odds (default: 0.3)"
+    )
+    parser.add_argument(
+        "--fps", type=float, default=None, help="Frames drawn per second (default: one per simulation tick)"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help=f"Seed of the race, to run it again, 0 to {MAX_SEED} (default: random)"
+    )
+    parser.add_argument(
+        "--record", default=None, help="Record the race in this replay file"
+    )
+    parser.add_argument(
+        "--replay", default=None, help="Play a recorded replay file instead of a new race"
+    )
+    parser.add_argument(
+        "--speed", type=float, default=1.0,
+        help=f"Playback speed of the race or the replay, {MIN_SPEED:g} to {MAX_SPEED:g}, the race is the same at any speed (default: 1.0)"
+    )
+    parser.add_argument(
+        "--from_tick", type=int, default=0, help="Start the replay from this tick (default: 0)"
+    )
+    parser.add_argument(
+        "--viewport", action="store_true", help="Show one row per lane and scroll, even if the field fits on screen"
+    )
+    parser.add_argument(
+        "--bets", default=None, help="Take the bets on the betting service at HOST:PORT (see betting.py)"
+    )
+    parser.add_argument(
+        "--bets_key", default=os.environ.get(betting.KEY_VARIABLE),
+        help=f"Operator key of the betting service (default: ${betting.KEY_VARIABLE})"
+    )
+    parser.add_argument(
+        "--rules", choices=race_engine.VARIANTS, default="stable", help="Play by the rules of this variant (default: stable)"
+    )
+    parser.add_argument(
+        "--save_results", action="store_true", help="Save the results of the race in the results store (see results_store.py)"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Time every phase of the frames and print a summary after the race"
+    )
+    args = parser.parse_args()
+    try:
+        if not MIN_SPEED <= args.speed <= MAX_SPEED:
+            raise ValueError(f"The speed goes from {MIN_SPEED:g} to {MAX_SPEED:g}.")
+        if args.seed is not None and not 0 <= args.seed <= MAX_SEED:
+            raise ValueError(f"The seed goes from 0 to {MAX_SEED}.")
+        if args.record and args.num_tortoises > MAX_TORTOISES:
+            raise ValueError(f"A replay holds {MAX_TORTOISES} tortoises at most.")
+        if args.replay:
+            profiler = curses.wrapper(watch_replay, args.replay, args.speed, args.fps, args.from_tick, args.viewport, args.profile)
+        else:
+            profiler = curses.wrapper(main, args.num_tortoises, args.odds_budget, args.fps, args.seed, args.record, args.viewport,
+                                      args.bets, args.rules, args.save_results, args.profile, args.speed,
+                                      args.bets_key)
+        if profiler:
+            print(profiler.summary())
+    except ValueError as e:
+        print(str(e))
@@ -0,0 +1,224 @@
+import argparse
+import curses
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import race_engine
+import tortoise_rushv8
+
+# A tournament: heats of a few tortoises run headless with the engine, spread over
+# a pool of processes, then only the final is watched in the curses view. Every heat
+# has its own seed, so the final on screen is the very race that was simulated.
+#
+#   round-robin  every round splits the roster into random heats, the top of the
+#                standings after all rounds races the final
+#   bracket      the first places of every heat go through to the next round until
+#                one heat is left, the final
+
+POINTS = [10, 8, 6, 5, 4, 3, 2, 1]  # Points by place in a heat, nothing for the others and for exploding
+HEAT_SIZE = 5
+ADVANCE = 2  # Tortoises of every bracket heat that go through to the next round
+FINISH_LINE = 70  # Same track for every heat, the final is shown on it
+
+
+def run_heat(heat):
+    """Run a heat and return its id, its finishing order and its exploded tortoises, as roster indices."""
+    heat_id, lanes, seed, rules, finish_line = heat
+    race = race_engine.new_race(len(lanes), finish_line, rules, random.Random(seed))
+    race_engine.run(race)
+    return heat_id, [lanes[i] for i in race["finished"]], [lanes[i] for i in race["exploded"]]
+
+
+def split(entrants, heat_size, rng):
+    """Shuffle the entrants into heats of heat_size tortoises at most, as even as possible."""
+    entrants = list(entrants)
+    rng.shuffle(entrants)
+    count = math.ceil(len(entrants) / heat_size)
+    return [entrants[k::count] for k in range(count)]
+
+
+def standings(roster, results):
+    """Rows of (name, points, wins, podiums, heats, average place) from first to last.
+
+    Ties on points are broken by wins, then podiums, then the best average place,
+    then the name.
+    """
+    table = {i: [0, 0, 0, 0, 0] for i in range(len(roster))}  # Points, wins, podiums, heats, sum of places
+    for order, exploded in results:
+        for place, i in enumerate(order, 1):
+            row = table[i]
+            row[0] += POINTS[place - 1] if place <= len(POINTS) else 0
+            row[1] += place == 1
+            row[2] += place <= 3
+            row[3] += 1
+            row[4] += place
+        for i in exploded:
+            table[i][3] += 1
+            table[i][4] += len(order) + 1  # Behind the last one to finish
+    rows = [
+        (roster[i], points, wins, podiums, heats, places / heats if heats else math.inf)
+        for i, (points, wins, podiums, heats, places) in table.items()
+    ]
+    return sorted(rows, key=lambda row: (-row[1], -row[2], -row[3], row[5], row[0]))
+
+
+class Tournament:
+    """Plan and run the heats of a tournament, all the heats of a round at once on the pool."""
+
+    def __init__(self, roster, mode="round-robin", rounds=10, heat_size=HEAT_SIZE,
+                 rules=race_engine.STABLE_RULES, finish_line=FINISH_LINE, seed=None, workers=None):
+        if len(roster) < 2:
+            raise ValueError("A tournament needs at least two tortoises.")
+        self.roster = roster
+        self.mode = mode
+        self.rounds = rounds
+        self.heat_size = heat_size
+        self.rules = rules
+        self.finish_line = finish_line
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.workers = workers or os.cpu_count() or 1
+        self.rng = random.Random(self.seed)
+        self.heats = []  # (heat id, round, lanes, seed) of every heat run
+        self.results = []  # (order, exploded) of every heat, in the same order
+        self.final = None  # Id of the final heat
+
+    def run(self):
+        with ProcessPoolExecutor(self.workers) as pool:
+            self._pool = pool
+            if self.mode == "bracket":
+                entrants = range(len(self.roster))
+                round_ = 0
+                while len(entrants) > self.heat_size:
+                    round_ += 1
+                    results = self._run_round(round_, split(entrants, self.heat_size, self.rng))
+                    entrants = [i for order, _ in results for i in order[:ADVANCE]]
+                    if not entrants:
+                        raise ValueError("Every tortoise of the round exploded.")
+                final = list(entrants)
+            else:
+                for round_ in range(1, self.rounds + 1):
+                    self._run_round(round_, split(range(len(self.roster)), self.heat_size, self.rng))
+                table = standings(self.roster, self.results)
+                index = {name: i for i, name in enumerate(self.roster)}
+                final = [index[row[0]] for row in table[:self.heat_size]]
+                round_ = self.rounds
+
+            # The final is a heat like the others, its lanes in reverse order of merit
+            self._run_round(round_ + 1, [final[::-1]])
+            self.final = len(self.heats) - 1
+        return self
+
+    def _run_round(self, round_, heats):
+        first = len(self.heats)
+        for lanes in heats:
+            self.heats.append((len(self.heats), round_, lanes, self.rng.randrange(2**32)))
+        jobs = [(heat_id, lanes, seed, self.rules, self.finish_line) for heat_id, _, lanes, seed in self.heats[first:]]
+        chunksize = max(1, len(jobs) // (self.workers * 4))
+        results = [(order, exploded) for _, order, exploded in self._pool.map(run_heat, jobs, chunksize=chunksize)]
+        self.results.extend(results)
+        return results
+
+    def standings(self):
+        return standings(self.roster, self.results)
+
+
+def watch_heat(stdscr, tournament, heat_id):
+    """Show a heat of the tournament in the race view, then the standings."""
+    curses.curs_set(0)  # Hide the cursor
+    stdscr.clear()
+    num_colors = tortoise_rushv8.init_colors()
+
+    # The same seed as in the tournament: the race on screen is the one that was simulated
+    _, round_, lanes, seed = tournament.heats[heat_id]
+    race = race_engine.new_race(len(lanes), tournament.finish_line, tournament.rules, random.Random(seed))
+    names = [tournament.roster[i] for i in lanes]
+    colors = tortoise_rushv8.tortoise_colors(seed, len(lanes), num_colors)
+
+    title = "Final" if heat_id == tournament.final else f"Heat {heat_id} (round {round_})"
+    addstr = tortoise_rushv8.clipped(stdscr)
+
+    def draw_title():
+        height, width = stdscr.getmaxyx()
+        stdscr.clear()
+        addstr(0, 0, title, curses.A_BOLD)
+        addstr(height // 2, width // 2 - 15, "Press any key to start the race!", curses.A_BOLD)
+        stdscr.refresh()
+
+    tortoise_rushv8.wait_key(stdscr, draw_title)
+    stdscr.clear()
+
+    if tortoise_rushv8.watch_race(stdscr, race, names, colors, lambda: race_engine.step(race), tournament.rules["frame_time"]):
+        return  # Left with q
+    tortoise_rushv8.show_results(stdscr, [names[i] for i in race["finished"]], seed)
+
+    # Standings, as many rows as fit
+    standings = tournament.standings()
+
+    def draw_standings():
+        height, width = stdscr.getmaxyx()
+        stdscr.clear()
+        addstr(0, 0, f"Standings after {len(tournament.heats)} heats", curses.A_BOLD)
+        addstr(1, 0, HEADER[:width - 1])
+        for place, row in enumerate(standings[:max(0, height - 3)], 1):
+            addstr(1 + place, 0, format_row(place, row)[:width - 1])
+        stdscr.refresh()
+
+    tortoise_rushv8.wait_key(stdscr, draw_standings)
+
+
+HEADER = f"{'':>5}{'Tortoise':<16}{'Points':>7}{'Wins':>6}{'Podiums':>9}{'Heats':>7}{'Avg place':>11}"
+
+
+def format_row(place, row):
+    name, points, wins, podiums, heats, average = row
+    return f"{place:>3}. {name:<16}{points:>7}{wins:>6}{podiums:>9}{heats:>7}{average:>11.2f}"
+
+
+def load_roster(path, size):
+    """Names from a file, one per line, or size names from the game's list."""
+    if path:
+        with open(path) as file:
+            return [line.strip() for line in file if line.strip()]
+    names = tortoise_rushv8.NAMES
+    return [names[i % len(names)].strip() + (f" {i // len(names) + 1}" if i >= len(names) else "") for i in range(size)]
+
+
+# Command-line argument parsing
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tortoise tournament: many heats simulated at once, the final on screen")
+    parser.add_argument("--roster", default=None, help="File with the names of the tortoises, one per line")
+    parser.add_argument("--entrants", type=int, default=20, help="Number of tortoises without a roster file (default: 20)")
+    parser.add_argument("--mode", choices=["round-robin", "bracket"], default="round-robin", help="Format of the tournament (default: round-robin)")
+    parser.add_argument("--rounds", type=int, default=10, help="Rounds of a round-robin season (default: 10)")
+    parser.add_argument("--heat_size", type=int, default=HEAT_SIZE, help=f"Tortoises per heat (default: {HEAT_SIZE})")
+    parser.add_argument("--rules", choices=race_engine.VARIANTS, default="stable", help="Rules of the races (default: stable)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the tournament, to run it again (default: random)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores)")
+    parser.add_argument("--show", default="final", help="Heat to watch: final, a heat number or none (default: final)")
+    args = parser.parse_args()
+
+    try:
+        roster = load_roster(args.roster, args.entrants)
+        if args.heat_size < 2 or (args.mode == "bracket" and args.heat_size <= ADVANCE):
+            raise ValueError(f"Heats need at least {ADVANCE + 1 if args.mode == 'bracket' else 2} tortoises.")
+        start = time.perf_counter()
+        tournament = Tournament(roster, args.mode, args.rounds, args.heat_size, race_engine.VARIANTS[args.rules],
+                                seed=args.seed, workers=args.workers).run()
+        elapsed = time.perf_counter() - start
+        if args.show != "none":
+            heat_id = tournament.final if args.show == "final" else int(args.show)
+            if not 0 <= heat_id < len(tournament.heats):
+                raise ValueError(f"There are {len(tournament.heats)} heats, numbered from 0.")
+            curses.wrapper(watch_heat, tournament, heat_id)
+    except ValueError as e:
+        print(str(e))
+    else:
+        final_order, _ = tournament.results[tournament.final]
+        print(f"{len(tournament.heats)} heats in {elapsed:.2f} seconds on {tournament.workers} processes (seed {tournament.seed})")
+        print(f"Champion: {tournament.roster[final_order[0]]}" if final_order else "Nobody finished the final")
+        print(HEADER)
+        for place, row in enumerate(tournament.standings(), 1):
+            print(format_row(place, row))
@@ -0,0 +1,89 @@
+import curses
+import heapq
+
+LEADERS_REFRESH = 5  # Frames between two searches of the leaders, the only step that looks at the whole field
+
+
+class Viewport:
+    """The lanes of the field that fit on screen.
+
+    Only these lanes are drawn, every other tortoise keeps racing off screen. The
+    viewport either shows a window of consecutive lanes, moved with the keyboard,
+    or follows the leaders of the race, one lane per place. A tracked tortoise is
+    kept on screen either way, in the last lane when it is not among the leaders.
+    """
+
+    def __init__(self, num_lanes, rows, first_row=2, lane_height=2):
+        self.num_lanes = num_lanes
+        self.size = max(1, rows // lane_height)  # Lanes on screen
+        self.first_row = first_row
+        self.lane_height = lane_height
+        self.top = 0
+        self.follow = False
+        self.track = None  # Index of the tracked tortoise
+        self._leaders = []
+        self._frame = 0
+
+    def lanes(self):
+        """(row, tortoise index) of every lane on screen."""
+        if self.follow:
+            indices = self._leaders
+            if self.track is not None and self.track not in indices:
+                indices = indices[:self.size - 1] + [self.track]
+        else:
+            indices = range(self.top, min(self.top + self.size, self.num_lanes))
+        return [(self.first_row + n * self.lane_height, i) for n, i in enumerate(indices)]
+
+    def scroll(self, lanes):
+        self.follow = False
+        self.track = None
+        self.top = max(0, min(self.top + lanes, self.num_lanes - self.size))
+
+    def handle_key(self, key):
+        """Move the viewport for the scrolling keys, return False for any other key."""
+        if key == curses.KEY_UP:
+            self.scroll(-1)
+        elif key == curses.KEY_DOWN:
+            self.scroll(1)
+        elif key == curses.KEY_PPAGE:
+            self.scroll(-self.size)
+        elif key == curses.KEY_NPAGE:
+            self.scroll(self.size)
+        elif key == curses.KEY_HOME:
+            self.scroll(-self.num_lanes)
+        elif key == curses.KEY_END:
+            self.scroll(self.num_lanes)
+        elif key == ord("f"):
+            self.follow = not self.follow
+            self._frame = 0
+        elif key in (ord("t"), ord("T")):
+            # Track the next or previous tortoise, none after the last one
+            step = 1 if key == ord("t") else -1
+            lane = (-1 if self.track is None else self.track) + step
+            self.track = None if lane in (-1, self.num_lanes) else lane % (self.num_lanes + 1)
+        else:
+            return False
+        return True
+
+    def update(self, race):
+        """Called once per frame, looks for the leaders every few frames when following them."""
+        if self.follow and self._frame % LEADERS_REFRESH == 0:
+            self._leaders = leaders(race, self.size)
+        self._frame += 1
+        if self.track is not None and not self.follow:
+            self.top = min(max(self.top, self.track - self.size + 1), self.track)
+
+    def status(self):
+        if self.follow:
+            return f"Following the {self.size} leaders of {self.num_lanes}  [f] scroll freely"
+        last = min(self.top + self.size, self.num_lanes)
+        return f"Lanes {self.top + 1}-{last} of {self.num_lanes}  [arrows/PgUp/PgDn] scroll  [f] follow the leaders"
+
+
+def leaders(race, count):
+    """Indices of the first count tortoises: the finished ones by place, then the others by distance."""
+    result = race["finished"][:count]
+    if len(result) < count:
+        tortoises = race["tortoises"]
+        result = result + heapq.nlargest(count - len(result), race["active"], key=tortoises.x.__getitem__)
+    return result
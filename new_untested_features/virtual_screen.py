@@ -0,0 +1,235 @@
+import contextlib
+import curses
+import unicodedata
+
+from renderer import BLANK, MOVE_COST, WIDE
+
+CLEAR_COST = 7  # Bytes of the escape sequences that clear the screen
+A_COLOR = 0xFF00  # Bits of an attribute that hold the color pair, as in ncurses
+COLORS = 8
+
+
+def _width(ch):
+    return 2 if unicodedata.east_asian_width(ch) in "WF" else 1
+
+
+class VirtualScreen:
+    """An in-memory window with the part of the curses API the game uses.
+
+    Drawing goes to a buffer of (character, attributes) cells, refresh() copies it
+    to the model of the terminal and counts what a real terminal would receive:
+    everything after a clear(), like curses which repaints the whole screen then,
+    otherwise only the runs of cells that changed. Keys are read from a queue;
+    once it is empty getch() returns -1 in nodelay() mode, a space otherwise. A
+    (height, width) tuple in the queue resizes the terminal, and getch() returns
+    KEY_RESIZE like ncurses does.
+    """
+
+    def __init__(self, height=24, width=80, keys=()):
+        self.height = height
+        self.width = width
+        self.keys = list(keys)
+        self.pairs = {0: (curses.COLOR_WHITE, curses.COLOR_BLACK)}  # Color pairs set with init_pair()
+        self.y = 0
+        self.x = 0
+        self._rows = {}  # Rows of the window, missing rows are blank
+        self._screen = {}  # Rows on the terminal
+        self._touched = set()
+        self._cleared = True
+        self._nodelay = False
+        self.refreshes = 0
+        self.cells_written = 0  # Cells sent by the last refresh()
+        self.bytes_written = 0  # Bytes sent by the last refresh()
+        self.total_cells = 0
+        self.total_bytes = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def getyx(self):
+        return self.y, self.x
+
+    def nodelay(self, flag):
+        self._nodelay = flag
+
+    def keypad(self, flag):
+        pass
+
+    def getch(self):
+        if self.keys:
+            key = self.keys.pop(0)
+            if isinstance(key, tuple):
+                self.resize(*key)
+                return curses.KEY_RESIZE
+            return ord(key) if isinstance(key, str) else key
+        return -1 if self._nodelay else ord(" ")
+
+    def flushinp(self):
+        """Drop the keys typed ahead, as curses.flushinp() does, the resizes stay."""
+        self.keys = [key for key in self.keys if isinstance(key, tuple)]
+
+    def resize(self, height, width):
+        """Change the size of the window, the cells that no longer fit are lost."""
+        self._rows = {y: (row + [BLANK] * width)[:width] for y, row in self._rows.items() if y < height}
+        self._touched = set(self._rows)
+        self.height, self.width = height, width
+        self.y, self.x = min(self.y, height - 1), min(self.x, width - 1)
+        self._cleared = True  # The terminal repaints everything after a resize
+
+    def move(self, y, x):
+        if not (0 <= y < self.height and 0 <= x < self.width):
+            raise curses.error("wmove() returned ERR")
+        self.y, self.x = y, x
+
+    def clear(self):
+        self.erase()
+        self._cleared = True
+
+    def erase(self):
+        self._touched.update(self._rows)
+        self._rows = {}
+        self.y = self.x = 0
+
+    def addstr(self, *args):
+        """addstr([y, x,] text[, attr]), text wraps at the right edge like in curses."""
+        y, x, text, attr = self._arguments(args)
+        for ch in text:
+            size = _width(ch)
+            if x + size > self.width:
+                y, x = y + 1, 0
+                if y >= self.height:
+                    raise curses.error("addwstr() returned ERR")
+            row = self._rows.get(y)
+            if row is None:
+                row = self._rows[y] = [BLANK] * self.width
+            row[x] = (ch, attr)
+            if size == 2:
+                row[x + 1] = (WIDE, attr)
+            self._touched.add(y)
+            x += size
+
+        # The cursor cannot move past the last cell of the window
+        if x >= self.width:
+            if y == self.height - 1:
+                raise curses.error("addwstr() returned ERR")
+            y, x = y + 1, 0
+        self.y, self.x = y, x
+
+    def addch(self, *args):
+        """addch([y, x,] ch[, attr]), ch being a character or its code."""
+        y, x, ch, attr = self._arguments(args)
+        if isinstance(ch, int):
+            attr |= ch & ~0xFF
+            ch = chr(ch & 0xFF)
+        self.addstr(y, x, ch, attr)
+
+    def refresh(self):
+        """Show the window on the terminal, counting the cells and bytes it takes."""
+        cells = 0
+        written = 0
+        if self._cleared:
+            written += CLEAR_COST
+            self._screen = {}
+            self._touched.update(self._rows)
+            self._cleared = False
+        blank = [BLANK] * self.width
+        for y in self._touched:
+            new = self._rows.get(y, blank)
+            old = self._screen.get(y, blank)
+            if new == old:
+                continue
+            x = 0
+            while x < self.width:
+                if new[x] == old[x]:
+                    x += 1
+                    continue
+                written += MOVE_COST
+                while x < self.width and new[x] != old[x]:
+                    cells += 1
+                    written += len(new[x][0].encode())
+                    x += 1
+            if y in self._rows:
+                self._screen[y] = list(new)
+            else:
+                self._screen.pop(y, None)
+        self._touched = set()
+        self.refreshes += 1
+        self.cells_written = cells
+        self.bytes_written = written
+        self.total_cells += cells
+        self.total_bytes += written
+
+    def _arguments(self, args):
+        # ([y, x,] value[, attr]) as curses takes them
+        if len(args) in (1, 2):
+            y, x = self.y, self.x
+        else:
+            y, x, args = args[0], args[1], args[2:]
+            if not (0 <= y < self.height and 0 <= x < self.width):
+                raise curses.error("wmove() returned ERR")
+        return y, x, args[0], args[1] if len(args) > 1 else 0
+
+    # What is on the terminal, for checks and snapshots
+
+    def snapshot(self):
+        """The cells on the terminal, as rows of (character, attributes) tuples."""
+        blank = (BLANK,) * self.width
+        return tuple(tuple(self._screen[y]) if y in self._screen else blank for y in range(self.height))
+
+    def text(self):
+        """The characters on the terminal, one string per row."""
+        return ["".join(ch for ch, _ in row) for row in self.snapshot()]
+
+    def attr(self, y, x):
+        """Attributes of the cell at (y, x) on the terminal."""
+        return self._screen.get(y, [BLANK] * self.width)[x][1]
+
+    def color(self, y, x):
+        """(foreground, background) of the cell at (y, x) on the terminal."""
+        return self.pairs.get((self.attr(y, x) & A_COLOR) >> 8)
+
+    def find(self, text):
+        """(y, x) of the first occurrence of text on the terminal, or None."""
+        for y, row in enumerate(self.text()):
+            x = row.find(text)
+            if x >= 0:
+                return y, x
+        return None
+
+
+@contextlib.contextmanager
+def virtual_terminal(screen):
+    """Make curses draw on screen: curses.wrapper() and the color functions use it until the end of the block."""
+    def wrapper(func, *args, **kwargs):
+        return func(screen, *args, **kwargs)
+
+    def init_pair(pair, fg, bg):
+        screen.pairs[pair] = (fg, bg)
+
+    patches = {
+        "wrapper": wrapper,
+        "initscr": lambda: screen,
+        "endwin": lambda: None,
+        "curs_set": lambda visibility: 1,
+        "start_color": lambda: None,
+        "use_default_colors": lambda: None,
+        "has_colors": lambda: True,
+        "init_pair": init_pair,
+        "pair_content": lambda pair: screen.pairs[pair],
+        "color_pair": lambda pair: (pair << 8) & A_COLOR,
+        "pair_number": lambda attr: (attr & A_COLOR) >> 8,
+        "flushinp": screen.flushinp,
+        "COLORS": COLORS,
+        "COLOR_PAIRS": 256,
+    }
+    saved = {name: getattr(curses, name) for name in patches if hasattr(curses, name)}
+    for name, value in patches.items():
+        setattr(curses, name, value)
+    try:
+        yield screen
+    finally:
+        for name in patches:
+            if name in saved:
+                setattr(curses, name, saved[name])
+            else:
+                delattr(curses, name)